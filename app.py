@@ -10,7 +10,7 @@ Diferenciais em relação ao app.py original:
   ✓ Sem senha hardcoded             → st.secrets["acesso"]["senha"]
   ✓ QR Code 100% em memória         → sem arquivos temp em disco
   ✓ Erros sempre visíveis           → sem except: pass silencioso
-  ✓ Sheets sem risco de perda       → clear() só depois dos dados prontos
+  ✓ Sheets sem risco de perda       → troca só as linhas da obra, em lote
   ✓ Decodificação IFC correta       → \\X2\\00D8\\X0\\ → "Ø"
   ✓ Armadura por (nome, pavimento)  → correta por pavimento, não global
   ✓ Todos os tipos estruturais      → pilares, vigas, lajes, fund., estacas
@@ -27,11 +27,12 @@ Estrutura de Psets TQS confirmada neste modelo:
 """
 
 import streamlit as st
-import os, re, io, tempfile, datetime, math
+import os, re, io, tempfile, datetime, math, hashlib, array, shutil
 from collections import defaultdict, Counter
 
 import ifcopenshell
 import ifcopenshell.util.element
+import numpy as np
 import pandas as pd
 import gspread
 from google.oauth2.service_account import Credentials
@@ -42,6 +43,8 @@ from reportlab.lib.units import mm
 from reportlab.lib import colors
 from reportlab.lib.utils import ImageReader
 
+from planilhas import obter_aba, sincronizar_abas
+
 
 # ──────────────────────────────────────────────────────────────────────────────
 # CONSTANTES
@@ -71,6 +74,30 @@ REGEX_BARRA = re.compile(
     re.UNICODE
 )
 
+# Padrões do parser STEP manual e da decodificação IFC — compilados uma vez,
+# pois rodam por linha do arquivo / por entidade dentro de indexar_armaduras.
+REGEX_ENTIDADE_STEP = re.compile(r"^#(\d+)=([A-Z][A-Z0-9_]*)\((.*)$")
+REGEX_REF_STEP      = re.compile(r"#(\d+)")
+REGEX_REF_NULO_STEP = re.compile(r"#(\d+)|\$")   # referência ou $ (posição preservada)
+REGEX_NUM_STEP      = re.compile(r"[-\d.E+]+")
+REGEX_IFC_X2        = re.compile(r'\\X2\\([0-9A-Fa-f]+)\\X0\\')
+REGEX_IFC_X         = re.compile(r'\\X\\([0-9A-Fa-f]{2})')
+REGEX_IFC_S         = re.compile(r'\\S\\(.)')
+
+# Bitola e comprimento (opcional) da barra numa única varredura:
+#   "1 P1 Ø10.00 C=230.00" → grupo(1)="10.00"  grupo(2)="230.00"
+#   "1 P1 Ø10.00"          → grupo(1)="10.00"  grupo(2)=None
+REGEX_BITOLA_COMP = re.compile(r"[Ø\u00d8](\d+\.?\d*)(?:\s+C=(\d+\.?\d*))?", re.UNICODE)
+
+# Caracteres fora de [A-Z0-9] — removidos das chaves (ID_Unico, ID da obra)
+REGEX_NAO_CHAVE = re.compile(r"[^A-Z0-9]")
+
+# Wrappers de tipo IFC em limpar_valor (roda para cada propriedade de cada Pset)
+REGEX_IFC_TEXTO    = re.compile(r"IFC(?:LABEL|TEXT|IDENTIFIER)\('(.*)'\)$", re.DOTALL)
+REGEX_IFC_MEDIDA   = re.compile(r"IFC\w+MEASURE\((.+)\)$")
+REGEX_IFC_BOOLEANO = re.compile(r"IFCBOOLEAN\(\.([TF])\.\)$")
+REGEX_IFC_NUMERO   = re.compile(r"IFC(?:INTEGER|REAL|COUNTMEASURE)\((.+)\)$")
+
 
 # ──────────────────────────────────────────────────────────────────────────────
 # DECODIFICAÇÃO DE STRINGS IFC
@@ -93,9 +120,9 @@ def decode_ifc(texto: str) -> str:
     def _decode_block(m):
         hex_str = m.group(1)
         return "".join(chr(int(hex_str[i:i+4], 16)) for i in range(0, len(hex_str), 4))
-    texto = re.sub(r'\\X2\\([0-9A-Fa-f]+)\\X0\\', _decode_block, texto)
+    texto = REGEX_IFC_X2.sub(_decode_block, texto)
     # ISO-8859-1 legacy
-    texto = re.sub(r'\\S\\(.)', lambda m: chr(0x80 + ord(m.group(1))), texto)
+    texto = REGEX_IFC_S.sub(lambda m: chr(0x80 + ord(m.group(1))), texto)
     return texto
 
 
@@ -104,23 +131,26 @@ def limpar_valor(valor: str) -> str:
     if not valor or valor.strip() == '$':
         return ""
     v = valor.strip()
+    if not v.startswith("IFC"):
+        # Valor nu (sem wrapper) — caso mais comum, nenhum padrão abaixo casa
+        return decode_ifc(v.strip("'"))
     # IFCLABEL / IFCTEXT / IFCIDENTIFIER com aspas
-    m = re.match(r"IFC(?:LABEL|TEXT|IDENTIFIER)\('(.*)'\)$", v, re.DOTALL)
+    m = REGEX_IFC_TEXTO.match(v)
     if m:
         return decode_ifc(m.group(1))
     # Medidas numéricas
-    m = re.match(r"IFC\w+MEASURE\((.+)\)$", v)
+    m = REGEX_IFC_MEDIDA.match(v)
     if m:
         try:
             return str(round(float(m.group(1)), 4))
         except ValueError:
             return m.group(1)
     # IFCBOOLEAN
-    m = re.match(r"IFCBOOLEAN\(\.([TF])\.\)$", v)
+    m = REGEX_IFC_BOOLEANO.match(v)
     if m:
         return "Sim" if m.group(1) == "T" else "Não"
     # IFCINTEGER / IFCREAL
-    m = re.match(r"IFC(?:INTEGER|REAL|COUNTMEASURE)\((.+)\)$", v)
+    m = REGEX_IFC_NUMERO.match(v)
     if m:
         return m.group(1)
     # Valor nu (sem wrapper)
@@ -131,10 +161,12 @@ def limpar_valor(valor: str) -> str:
 # AUTENTICAÇÃO
 # ──────────────────────────────────────────────────────────────────────────────
 
+@st.cache_resource
 def conectar_sheets() -> gspread.Client:
     """
     Autentica usando st.secrets (produção) ou credenciais.json (local).
     Configure em .streamlit/secrets.toml — nunca versionar.
+    Cliente único por processo (st.cache_resource): sem reautenticar a cada rerun.
     """
     scopes = [
         "https://www.googleapis.com/auth/spreadsheets",
@@ -152,6 +184,12 @@ def conectar_sheets() -> gspread.Client:
     return gspread.authorize(creds)
 
 
+@st.cache_resource
+def abrir_planilha() -> gspread.Spreadsheet:
+    """Planilha aberta uma vez por processo: client.open faz uma busca no Drive a cada chamada."""
+    return conectar_sheets().open(NOME_PLANILHA)
+
+
 def verificar_senha() -> str:
     """
     Retorna a senha do secrets.toml.
@@ -202,17 +240,15 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
 
     Retorna: { elemento_eid_int: [(bitola, comp_cm, sub_tipo), ...] }
     """
-    import re as _re
-
     # ── Decodificação IFC robusta (ambos os formatos) ─────────────────────────
     def _dec(s):
         if not s: return ""
         def _x2(m):
             h = m.group(1)
             return "".join(chr(int(h[i:i+4],16)) for i in range(0,len(h),4))
-        s = _re.sub(r'\\X2\\([0-9A-Fa-f]+)\\X0\\', _x2, s)
-        s = _re.sub(r'\\X\\([0-9A-Fa-f]{2})', lambda m: chr(int(m.group(1),16)), s)
-        s = _re.sub(r'\\S\\(.)', lambda m: chr(0x80+ord(m.group(1))), s)
+        s = REGEX_IFC_X2.sub(_x2, s)
+        s = REGEX_IFC_X.sub(lambda m: chr(int(m.group(1),16)), s)
+        s = REGEX_IFC_S.sub(lambda m: chr(0x80+ord(m.group(1))), s)
         return s
 
     # ── Parser manual linha a linha ───────────────────────────────────────────
@@ -235,7 +271,7 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
             if not _ln or _ln.startswith((
                 "ISO-10303","HEADER;","DATA;","ENDSEC;","END-ISO","FILE_","/*"
             )): continue
-            _m = _re.match(r"^#(\d+)=([A-Z][A-Z0-9_]*)\((.*)$", _ln)
+            _m = REGEX_ENTIDADE_STEP.match(_ln)
             if _m:
                 if _cid and _ctype:
                     _d = ",".join(_cdata)
@@ -306,15 +342,35 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
             pass
 
     # ── Passo 2: Psets via ifcopenshell ──────────────────────────────────────
-    def _psets(elem) -> dict:
-        try:
-            import ifcopenshell.util.element as _ie
-            return _ie.get_psets(elem)
-        except Exception:
-            return {}
+    # Só um Pset por consulta: procura o nome pedido no tipo (HasPropertySets)
+    # e em IsDefinedBy, sem montar o dict de todos os Psets (get_psets) — a
+    # maioria das barras nem tem TQS_Padrao. Como get_psets, o Pset do tipo é
+    # herdado e a ocorrência prevalece. Memoizado: _dim é chamado até 3× por elemento.
+    _cache_pset: dict[tuple,dict] = {}
+    def _pset(elem, nome: str) -> dict:
+        chave = (elem.id(), nome)
+        props = _cache_pset.get(chave)
+        if props is None:
+            props = {}
+            try:
+                tipo = ifcopenshell.util.element.get_type(elem)
+                for d in getattr(tipo, "HasPropertySets", None) or ():
+                    if getattr(d, "Name", None) == nome:
+                        props = dict(ifcopenshell.util.element.get_property_definition(d) or {})
+                        break
+                for rel in getattr(elem, "IsDefinedBy", None) or ():
+                    if not rel.is_a("IfcRelDefinesByProperties"): continue
+                    defs = rel.RelatingPropertyDefinition
+                    for d in defs if isinstance(defs, (list, tuple)) else (defs,):
+                        if getattr(d, "Name", None) == nome:
+                            props.update(ifcopenshell.util.element.get_property_definition(d) or {})
+            except Exception:
+                props = {}
+            _cache_pset[chave] = props
+        return props
 
     def _dim(elem, *keys) -> float:
-        geo = _psets(elem).get("TQS_Geometria", {})
+        geo = _pset(elem, "TQS_Geometria")
         for k in keys:
             v = geo.get(k)
             if v is not None:
@@ -323,7 +379,7 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
         return 0.0
 
     def _num_planta(elem) -> tuple:
-        p = _psets(elem).get("TQS_Padrao", {})
+        p = _pset(elem, "TQS_Padrao")
         try: num = int(str(p.get("Numero","")).strip())
         except: num = None
         planta = str(p.get("Planta","") or "").strip()
@@ -338,14 +394,14 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
         if len(parts)<6: return None
         lp = parts[5].strip().lstrip("#")
         if lp not in _ents: return None
-        lrefs = _re.findall(r"#(\d+)|\$", _ents[lp][1])
+        lrefs = REGEX_REF_NULO_STEP.findall(_ents[lp][1])
         ax = lrefs[1] if len(lrefs)>1 and lrefs[1]!="$" else None
         if ax and ax in _ents:
-            arefs = _re.findall(r"#(\d+)", _ents[ax][1])
+            arefs = REGEX_REF_STEP.findall(_ents[ax][1])
             if arefs:
                 pt = arefs[0]
                 if pt in _ents and _ents[pt][0]=="IFCCARTESIANPOINT":
-                    c = _re.findall(r"[-\d.E+]+", _ents[pt][1])
+                    c = REGEX_NUM_STEP.findall(_ents[pt][1])
                     if len(c)>=2: return float(c[0]), float(c[1])
         return None
 
@@ -364,21 +420,22 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
                    "IFCFACEOUTERBOUND","IFCPOLYLOOP","IFCCARTESIANPOINT",
                    # TQS v24+: FaceBasedSurfaceModel
                    "IFCFACEBASEDSURFACEMODEL","IFCCONNECTEDFACESET"}
-        pts=[]; vis=set()
+        pts=array.array("d"); vis=set()   # x,y contíguos em float64
         def _wk(pid, d=0):
             if pid in vis or pid not in _ents or d>12: return
             vis.add(pid)
             et2,ed2=_ents[pid]
             if et2 not in allowed: return
             if et2=="IFCCARTESIANPOINT":
-                c=_re.findall(r"[-\d.E+]+",ed2)
-                if len(c)>=2: pts.append((float(c[0]),float(c[1])))
+                c=REGEX_NUM_STEP.findall(ed2)
+                if len(c)>=2: pts.extend((float(c[0]),float(c[1])))
                 return
-            for r in _re.findall(r"#(\d+)",ed2): _wk(r,d+1)
+            for r in REGEX_REF_STEP.findall(ed2): _wk(r,d+1)
         _wk(repr_id)
         if not pts: return None
-        xs=[p[0] for p in pts]; ys=[p[1] for p in pts]
-        return (min(xs)+max(xs))/2, (min(ys)+max(ys))/2
+        xy=np.frombuffer(pts,dtype=np.float64).reshape(-1,2)
+        cx,cy=(xy.min(axis=0)+xy.max(axis=0))/2
+        return float(cx), float(cy)
 
     def _placement_offset(eid_str: str) -> tuple:
         """Retorna (dx, dy) do ObjectPlacement local do elemento.
@@ -396,13 +453,13 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
             vis.add(pid)
             pt,pd = _ents[pid]
             if pt == "IFCLOCALPLACEMENT":
-                for r in _re.findall(r"#(\d+)", pd):
+                for r in REGEX_REF_STEP.findall(pd):
                     if r not in _ents: continue
                     rt,rd = _ents[r]
                     if rt == "IFCAXIS2PLACEMENT3D":
-                        ax_refs = _re.findall(r"#(\d+)", rd)
+                        ax_refs = REGEX_REF_STEP.findall(rd)
                         if ax_refs and _ents.get(ax_refs[0], ("",""))[0] == "IFCCARTESIANPOINT":
-                            c = _re.findall(r"[-\d.E+]+", _ents[ax_refs[0]][1])
+                            c = REGEX_NUM_STEP.findall(_ents[ax_refs[0]][1])
                             if len(c) >= 2:
                                 return float(c[0]), float(c[1])
             return 0.0, 0.0
@@ -455,23 +512,25 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
         et,ed = _ents[eid_str]
         parts = ed.split(","); repr_id = parts[6].strip().lstrip("#") if len(parts)>6 else ""
         if repr_id not in _ents: return None
-        pts=[]; vis=set()
+        pts=array.array("d"); vis=set()   # x,y,z contíguos em float64
         def _wk(pid, d=0):
             if pid in vis or pid not in _ents or d>12: return
             vis.add(pid); et2,ed2=_ents[pid]
             if et2 not in _BREP_TYPES: return
             if et2=="IFCCARTESIANPOINT":
-                c=_re.findall(r"[-\d.E+]+",ed2)
-                if len(c)>=3: pts.append((float(c[0]),float(c[1]),float(c[2])))
+                c=REGEX_NUM_STEP.findall(ed2)
+                if len(c)>=3: pts.extend((float(c[0]),float(c[1]),float(c[2])))
                 return
-            for r in _re.findall(r"#(\d+)",ed2): _wk(r,d+1)
+            for r in REGEX_REF_STEP.findall(ed2): _wk(r,d+1)
         _wk(repr_id)
         if not pts: return None
         dx_p, dy_p = _placement_offset(eid_str)
-        xs=[p[0]+dx_p for p in pts]; ys=[p[1]+dy_p for p in pts]; zs=[p[2] for p in pts]
-        dx=max(xs)-min(xs); dy=max(ys)-min(ys)
-        eixo="X" if dx>=dy else "Y"
-        return (min(xs),max(xs),min(ys),max(ys),min(zs),max(zs),eixo)
+        xyz=np.frombuffer(pts,dtype=np.float64).reshape(-1,3)
+        mn,mx=xyz.min(axis=0),xyz.max(axis=0)   # min/max de cada eixo numa passada
+        xmin,ymin,zmin=float(mn[0])+dx_p,float(mn[1])+dy_p,float(mn[2])
+        xmax,ymax,zmax=float(mx[0])+dx_p,float(mx[1])+dy_p,float(mx[2])
+        eixo="X" if xmax-xmin>=ymax-ymin else "Y"
+        return (xmin,xmax,ymin,ymax,zmin,zmax,eixo)
 
     def _viga_bbox3d_extruded(elem):
         """Estima bbox 3D de viga com ExtrudedAreaSolid (v27) via placement + dims."""
@@ -598,21 +657,22 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
         parts = ed.split(",")
         repr_id = parts[6].strip().lstrip("#") if len(parts) > 6 else ""
         if repr_id not in _ents: return None
-        pts3d = []; vis = set()
+        pts3d = array.array("d"); vis = set()   # x,y,z contíguos em float64
         def _wk(pid, d=0):
             if pid in vis or pid not in _ents or d > 12: return
             vis.add(pid); et2,ed2 = _ents[pid]
             if et2 not in _BREP_BAR: return
             if et2 == "IFCCARTESIANPOINT":
-                c = _re.findall(r"[-\d.E+]+", ed2)
+                c = REGEX_NUM_STEP.findall(ed2)
                 if len(c) >= 3:
-                    pts3d.append((float(c[0]), float(c[1]), float(c[2])))
+                    pts3d.extend((float(c[0]), float(c[1]), float(c[2])))
                 return
-            for r in _re.findall(r"#(\d+)", ed2): _wk(r, d+1)
+            for r in REGEX_REF_STEP.findall(ed2): _wk(r, d+1)
         _wk(repr_id)
         if not pts3d: return None
-        xs=[p[0] for p in pts3d]; ys=[p[1] for p in pts3d]; zs=[p[2] for p in pts3d]
-        return ((min(xs)+max(xs))/2, (min(ys)+max(ys))/2, (min(zs)+max(zs))/2)
+        xyz = np.frombuffer(pts3d, dtype=np.float64).reshape(-1, 3)
+        cx, cy, cz = (xyz.min(axis=0) + xyz.max(axis=0)) / 2
+        return (float(cx), float(cy), float(cz))
 
     def _bar_placement_z(barra) -> float:
         """Retorna o offset Z do ObjectPlacement da barra.
@@ -630,13 +690,13 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
             if pid in vis or pid not in _ents or d > 6: return 0.0
             vis.add(pid); pt, pd = _ents[pid]
             if pt == "IFCLOCALPLACEMENT":
-                for r in _re.findall(r"#(\d+)", pd):
+                for r in REGEX_REF_STEP.findall(pd):
                     if r not in _ents: continue
                     rt, rd = _ents[r]
                     if rt == "IFCAXIS2PLACEMENT3D":
-                        ax = _re.findall(r"#(\d+)", rd)
+                        ax = REGEX_REF_STEP.findall(rd)
                         if ax and _ents.get(ax[0], ("",""))[0] == "IFCCARTESIANPOINT":
-                            c = _re.findall(r"[-\d.E+]+", _ents[ax[0]][1])
+                            c = REGEX_NUM_STEP.findall(_ents[ax[0]][1])
                             if len(c) >= 3: return float(c[2])
             return 0.0
         return _wk(place_ref)
@@ -656,11 +716,6 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
             return (pt[0], pt[1], pt[2] + dz)
         return None
 
-    # Alias para compatibilidade: só (x,y)
-    def _bar_xy(barra):
-        r = _bar_xyz(barra)
-        return (r[0], r[1]) if r else None
-
     # ── Extrator especializado para barras de sapata (CompositeCurve 3 segs) ──
     # Cada barra de fundação TQS tem 3 segmentos em U:
     #   Seg 0: gancho entrada (IfcLine vertical, magnitude = gancho_cm)
@@ -686,28 +741,28 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
             if cc_id[0] or pid in vis or pid not in _ents or d>6: return
             vis.add(pid); et2,ed2 = _ents[pid]
             if et2 == "IFCCOMPOSITECURVE": cc_id[0] = pid; return
-            for r in _re.findall(r"#(\d+)", ed2): _find_cc(r, d+1)
+            for r in REGEX_REF_STEP.findall(ed2): _find_cc(r, d+1)
         _find_cc(repr_id)
         if not cc_id[0]: return None
 
         cc_et, cc_ed = _ents[cc_id[0]]
         # Extrair ids dos CompositeCurveSegments
-        seg_refs = _re.findall(r"#(\d+)", cc_ed.split(",(")[1] if ",(" in cc_ed else cc_ed)
+        seg_refs = REGEX_REF_STEP.findall(cc_ed.split(",(")[1] if ",(" in cc_ed else cc_ed)
         segs = []
         for sid in seg_refs:
             if sid not in _ents: continue
             st,sd = _ents[sid]
             if st != "IFCCOMPOSITECURVESEGMENT": continue
-            line_id = _re.findall(r"#(\d+)", sd)[-1]
+            line_id = REGEX_REF_STEP.findall(sd)[-1]
             if line_id not in _ents: continue
             lt,ld = _ents[line_id]
             if lt != "IFCLINE": continue
-            refs = _re.findall(r"#(\d+)", ld)
+            refs = REGEX_REF_STEP.findall(ld)
             if len(refs) < 2: continue
             pnt_id, vec_id = refs[0], refs[1]
             # Ponto inicial
             pt_et, pt_ed = _ents.get(pnt_id, ("",""))
-            coords = _re.findall(r"[-\d.E+]+", pt_ed)
+            coords = REGEX_NUM_STEP.findall(pt_ed)
             if len(coords) < 3: continue
             px,py,pz = float(coords[0]),float(coords[1]),float(coords[2])
             # Vetor magnitude
@@ -716,10 +771,10 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
             try: mag = abs(float(vec_parts[-1].strip()))
             except: continue
             # Direcao do vetor
-            dir_refs = _re.findall(r"#(\d+)", vec_ed)
+            dir_refs = REGEX_REF_STEP.findall(vec_ed)
             dx,dy,dz = 0.0,0.0,0.0
             if dir_refs and dir_refs[0] in _ents:
-                dc = _re.findall(r"[-\d.E+]+", _ents[dir_refs[0]][1])
+                dc = REGEX_NUM_STEP.findall(_ents[dir_refs[0]][1])
                 if len(dc)>=3: dx,dy,dz = float(dc[0]),float(dc[1]),float(dc[2])
             segs.append({"p":(px,py,pz),"mag":mag,"d":(dx,dy,dz)})
 
@@ -743,7 +798,7 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
                 try: _diam[0] = abs(float(_p2[1].strip())) * 2.0
                 except: pass
                 return
-            for _r in _re.findall(r"#(\d+)", _ed2): _find_sds(_r, d+1)
+            for _r in REGEX_REF_STEP.findall(_ed2): _find_sds(_r, d+1)
         _find_sds(repr_id)
         comp_total = corpo + _diam[0]  # Box Length = corpo + diâmetroiâmetro
 
@@ -761,7 +816,7 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
 
     # ── Passo 7: Numero+Planta da barra (fallback para vigas/lajes) ──────────
     def _bar_num_planta(barra):
-        p=_psets(barra).get("TQS_Padrao",{})
+        p=_pset(barra,"TQS_Padrao")
         try: num=int(str(p.get("Numero","")).strip())
         except: num=None
         planta=str(p.get("Planta","") or "").strip()
@@ -769,26 +824,20 @@ def indexar_armaduras(ifc_file, ifc_path: str | None = None) -> dict:
 
     # ── Passo 8: vincular barras → elementos ─────────────────────────────────
     cache: dict[int,list] = defaultdict(list)
-    REGEX_B = re.compile(r"[Ø\u00d8](\d+\.?\d*)\s+C=(\d+\.?\d*)", re.UNICODE)
-    REGEX_D = re.compile(r"[Ø\u00d8](\d+\.?\d*)", re.UNICODE)
 
     sem_diam=sem_xy=sem_match=sem_num=0
     vin_spatial=vin_numero=0
 
-    for barra in ifc_file.by_type("IfcReinforcingBar"):
+    for barra in ifc_file.by_type("IfcReinforcingBar", include_subtypes=False):
         try:
             ot_raw = _dec(barra.ObjectType or "")
             tipo_step = OBJ_TO_IFC.get(ot_raw)
             if not tipo_step: continue
 
             nome = _dec(barra.Name or "")
-            mb = REGEX_B.search(nome)
-            if mb:
-                bitola=float(mb.group(1)); comp_cm=float(mb.group(2))
-            else:
-                md = REGEX_D.search(nome)
-                if not md: sem_diam+=1; continue
-                bitola=float(md.group(1)); comp_cm=0.0
+            mb = REGEX_BITOLA_COMP.search(nome)
+            if not mb: sem_diam+=1; continue
+            bitola=float(mb.group(1)); comp_cm=float(mb.group(2) or 0.0)
 
             sub = OBJ_SUB.get(ot_raw,"long")
             pav = storey_por_elem.get(barra.id(),"Sem pavimento")
@@ -1165,15 +1214,46 @@ def detalhar_armadura(cache: dict, elem_eid: int) -> dict:
 # EXTRAÇÃO DE DADOS POR TIPO DE ELEMENTO
 # ──────────────────────────────────────────────────────────────────────────────
 
-def _psets(elem) -> dict:
+def _mapear_psets(ifc) -> dict[int, list]:
+    """
+    Percorre IfcRelDefinesByType e IfcRelDefinesByProperties uma única vez e
+    retorna {id_elemento: [IfcPropertySetDefinition, ...]}, evitando que cada
+    elemento resolva sua relação inversa IsDefinedBy separadamente.
+    Como get_psets, inclui os Psets do tipo (HasPropertySets) — antes dos da
+    ocorrência, que prevalecem em _psets.
+    """
+    mapa: dict[int, list] = defaultdict(list)
+    for rel in ifc.by_type("IfcRelDefinesByType"):
+        defs = list(getattr(rel.RelatingType, "HasPropertySets", None) or [])
+        if defs:
+            for obj in rel.RelatedObjects or []:
+                mapa[obj.id()].extend(defs)
+    for rel in ifc.by_type("IfcRelDefinesByProperties"):
+        defs = rel.RelatingPropertyDefinition
+        defs = list(defs) if isinstance(defs, (list, tuple)) else [defs]
+        for obj in rel.RelatedObjects or []:
+            mapa[obj.id()].extend(defs)
+    return mapa
+
+
+def _psets(elem, defs: list | None = None) -> dict:
     """
     Retorna todos os Psets de um elemento como dict plano:
     { 'NomePset.NomeProp': 'valor_limpo' }
+    `defs`: definições já indexadas por _mapear_psets (senão usa get_psets).
     Nunca lança exceção — registra warning e continua.
     """
     resultado = {}
     try:
-        raw = ifcopenshell.util.element.get_psets(elem)
+        if defs is not None:
+            # Mesmo nome no tipo e na ocorrência: funde, a ocorrência prevalece
+            raw: dict[str, dict] = {}
+            for d in defs:
+                if getattr(d, "Name", None):
+                    raw.setdefault(d.Name, {}).update(
+                        ifcopenshell.util.element.get_property_definition(d) or {})
+        else:
+            raw = ifcopenshell.util.element.get_psets(elem)
         for pset_nome, props in raw.items():
             pset_dec = decode_ifc(str(pset_nome))
             for prop_nome, prop_val in props.items():
@@ -1185,19 +1265,36 @@ def _psets(elem) -> dict:
     return resultado
 
 
-def _pavimento(elem) -> str:
-    """Retorna nome do IfcBuildingStorey do elemento."""
-    try:
-        if elem.ContainedInStructure:
-            return decode_ifc(elem.ContainedInStructure[0].RelatingStructure.Name or "")
-    except Exception:
-        pass
-    return "Sem pavimento"
+def _mapear_pavimentos(ifc) -> dict[int, str]:
+    """
+    Retorna {id_elemento: nome do IfcBuildingStorey} numa única passada sobre
+    IfcRelContainedInSpatialStructure, em vez de resolver a relação inversa
+    ContainedInStructure elemento a elemento.
+    Elementos fora do dict não estão contidos em pavimento ("Sem pavimento").
+    """
+    pavimentos: dict[int, str] = {}
+    for rel in ifc.by_type("IfcRelContainedInSpatialStructure"):
+        try:
+            nome = decode_ifc(rel.RelatingStructure.Name or "")
+            for elem in rel.RelatedElements:
+                pavimentos.setdefault(elem.id(), nome)
+        except Exception:
+            pass
+    return pavimentos
+
+
+# Varredura de _bbox: atributos que levam aos IfcCartesianPoint. Quais deles
+# cada classe IFC possui depende só do schema — resolvido uma vez por classe.
+_ATRIBUTOS_GEOMETRIA = ("Points", "OuterCurve", "PolygonalBoundary", "Polygon",
+                        "Items", "MappedRepresentation", "MappingSource",
+                        "SweptArea", "Bounds", "Bound", "CfsFaces", "FbsmFaces",
+                        "Position", "BaseSurface")
+_ATRIBUTOS_POR_CLASSE: dict[str, tuple[str, ...]] = {}
 
 
 def _bbox(elem) -> dict:
     """
-    Extrai bounding box 3D por varredura recursiva dos CartesianPoints.
+    Extrai bounding box 3D por varredura (pilha explícita) dos CartesianPoints.
     Unidade do TQS: centímetros (IFCSIUNIT CENTI METRE).
     Retorna dimensões em cm e coordenadas do centróide.
     Nunca lança exceção — retorna zeros com warning.
@@ -1208,57 +1305,64 @@ def _bbox(elem) -> dict:
         if not getattr(elem, "Representation", None):
             return vazio
 
-        xs, ys, zs = [], [], []
+        # Buffers contíguos de float64: x,y de todos os pontos; z apenas dos 3D
+        pts, zs = array.array("d"), array.array("d")
+        # Entidades já visitadas pelo id STEP (pontos compartilhados entre faces);
+        # id(obj) não serve: cada acesso cria um wrapper Python novo.
         visitados: set = set()
 
-        def coletar(obj, profundidade=0):
+        # Varredura iterativa com pilha explícita de (obj, profundidade)
+        pilha = [(item, 0)
+                 for rep in elem.Representation.Representations
+                 if rep.RepresentationIdentifier in ("Body", "Mesh", "Box", "Facetation", "Axis")
+                 for item in rep.Items]
+        while pilha:
+            obj, profundidade = pilha.pop()
             if obj is None or profundidade > 14:
-                return
-            oid = id(obj)
-            if oid in visitados:
-                return
-            visitados.add(oid)
-
-            if hasattr(obj, "is_a"):
-                if obj.is_a("IfcCartesianPoint") and hasattr(obj, "Coordinates"):
-                    c = obj.Coordinates
-                    if len(c) >= 2:
-                        xs.append(float(c[0]))
-                        ys.append(float(c[1]))
-                        if len(c) >= 3:
-                            zs.append(float(c[2]))
-                    return
-
-                for attr in ("Points", "OuterCurve", "PolygonalBoundary", "Polygon",
-                             "Items", "MappedRepresentation", "MappingSource",
-                             "SweptArea", "Bounds", "Bound", "CfsFaces", "FbsmFaces",
-                             "Position", "BaseSurface"):
-                    if not hasattr(obj, attr):
-                        continue
-                    val = getattr(obj, attr)
-                    if isinstance(val, (list, tuple)):
-                        for v in val:
-                            coletar(v, profundidade + 1)
-                    else:
-                        coletar(val, profundidade + 1)
-
-            elif isinstance(obj, (list, tuple)):
-                for item in obj:
-                    coletar(item, profundidade + 1)
-
-        for rep in elem.Representation.Representations:
-            if rep.RepresentationIdentifier in ("Body", "Mesh", "Box", "Facetation", "Axis"):
-                for item in rep.Items:
-                    coletar(item)
-
-        if not xs:
+                continue
+
+            if isinstance(obj, (list, tuple)):
+                pilha.extend((v, profundidade + 1) for v in obj)
+                continue
+            if not hasattr(obj, "is_a"):
+                continue
+            oid = obj.id()
+            if oid:
+                if oid in visitados:
+                    continue
+                visitados.add(oid)
+
+            classe = obj.is_a()
+            if classe == "IfcCartesianPoint":
+                c = obj.Coordinates
+                if len(c) >= 2:
+                    pts.extend(c[:2])
+                    if len(c) >= 3:
+                        zs.append(c[2])
+                continue
+
+            atributos = _ATRIBUTOS_POR_CLASSE.get(classe)
+            if atributos is None:
+                atributos = _ATRIBUTOS_POR_CLASSE[classe] = tuple(
+                    a for a in _ATRIBUTOS_GEOMETRIA if hasattr(obj, a))
+            for attr in atributos:
+                val = getattr(obj, attr)
+                if isinstance(val, (list, tuple)):
+                    pilha.extend((v, profundidade + 1) for v in val)
+                else:
+                    pilha.append((val, profundidade + 1))
+
+        if not pts:
             return vazio
 
-        comp = round(max(xs) - min(xs), 2)
-        larg = round(max(ys) - min(ys), 2)
-        alt  = round(max(zs) - min(zs), 2) if zs else 0.0
-        cx   = round((min(xs) + max(xs)) / 2, 2)
-        cy   = round((min(ys) + max(ys)) / 2, 2)
+        # Redução min/max vetorizada (NumPy) em vez de 4 passagens em listas
+        xy = np.frombuffer(pts, dtype=np.float64).reshape(-1, 2)
+        mn, mx = xy.min(axis=0), xy.max(axis=0)
+        comp = round(float(mx[0] - mn[0]), 2)
+        larg = round(float(mx[1] - mn[1]), 2)
+        alt  = round(float(np.ptp(np.frombuffer(zs, dtype=np.float64))), 2) if zs else 0.0
+        cx   = round(float(mn[0] + mx[0]) / 2, 2)
+        cy   = round(float(mn[1] + mx[1]) / 2, 2)
 
         return {"comp_cm": comp, "larg_cm": larg, "alt_cm": alt,
                 "coord_x": cx, "coord_y": cy}
@@ -1271,9 +1375,9 @@ def _bbox(elem) -> dict:
 def _id_unico(elem, id_projeto: str, pavimento: str) -> str:
     """Chave primária única e segura para uso como QR Code."""
     guid  = (elem.GlobalId or "NOGUID")[:8]
-    nome  = re.sub(r"[^A-Z0-9]", "", (elem.Name or "").upper())[:8]
-    pav   = re.sub(r"[^A-Z0-9]", "", pavimento.upper())[:8]
-    proj  = re.sub(r"[^A-Z0-9]", "", id_projeto.upper())[:10]
+    nome  = REGEX_NAO_CHAVE.sub("", (elem.Name or "").upper())[:8]
+    pav   = REGEX_NAO_CHAVE.sub("", pavimento.upper())[:8]
+    proj  = REGEX_NAO_CHAVE.sub("", id_projeto.upper())[:10]
     return f"{proj}-{pav}-{nome}-{guid}"
 
 
@@ -1282,9 +1386,13 @@ def _id_unico(elem, id_projeto: str, pavimento: str) -> str:
 # PIPELINE PRINCIPAL DE EXTRAÇÃO
 # ──────────────────────────────────────────────────────────────────────────────
 
-def _natural_key(texto: str) -> list:
-    return [int(c) if c.isdigit() else c.lower()
-            for c in re.split(r"(\d+)", texto or "")]
+REGEX_DIGITOS = re.compile(r"(\d+)")
+
+
+def _natural_key(texto: str) -> tuple:
+    """Chave de ordenação natural (P2 < P10); tupla compara sem alocar listas."""
+    return tuple(int(c) if c.isdigit() else c.lower()
+                 for c in REGEX_DIGITOS.split(texto or ""))
 
 
 def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict]:
@@ -1304,26 +1412,19 @@ def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict
     # e outro sem (secundário). Apenas o principal gera registro; o secundário
     # é suprimido e suas barras transferidas ao principal.
     NOS_SAPATAS: set[int] = set()
+    psets_por_elem = _mapear_psets(ifc)
+    pavimentos     = _mapear_pavimentos(ifc)
 
     _sapatas_por_nome: dict = {}  # (nome, pav) → [eid_com_geo, eid_sem_geo]
-    try:
-        import ifcopenshell.util.element as _iue_sap
-    except Exception:
-        _iue_sap = None
 
     for _elem in ifc.by_type("IfcFooting"):
-        _pav = _pavimento(_elem)
+        _pav = pavimentos.get(_elem.id(), "Sem pavimento")
         _nome = _elem.Name or "S/N"
         # Verificar se tem Pset_TQS_Geometria (presença de Dimensoes_X)
-        _tem_geo = False
-        try:
-            if _iue_sap:
-                _ps2 = _iue_sap.get_psets(_elem)
-                _tem_geo = bool(
-                    _ps2.get("TQS_Geometria") or _ps2.get("Pset_TQS_Geometria")
-                )
-        except Exception:
-            pass
+        _tem_geo = any(
+            getattr(d, "Name", None) in ("TQS_Geometria", "Pset_TQS_Geometria")
+            for d in psets_por_elem.get(_elem.id(), ())
+        )
         _key = (_nome, _pav)
         _sapatas_por_nome.setdefault(_key, {"principal": None, "secundarios": []})
         if _tem_geo:
@@ -1353,10 +1454,7 @@ def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict
     # Agrupar segmentos por (nome, pavimento) e calcular comprimento via bbox
     _segs_por_viga: dict = {}  # (nome, pav) → [(eid, comp_cm), ...]
     for _elem in ifc.by_type("IfcBeam"):
-        _pav = decode_ifc(
-            (_elem.ContainedInStructure[0].RelatingStructure.Name or "")
-            if _elem.ContainedInStructure else ""
-        ) or "Sem pavimento"
+        _pav = pavimentos.get(_elem.id()) or "Sem pavimento"
         _nome = _elem.Name or "S/N"
         # Comprimento via viga_bbox3d já calculada em indexar_armaduras.
         # xmin,xmax,ymin,ymax,zmin,zmax,eixo  → dimensão dominante = comprimento
@@ -1421,6 +1519,7 @@ def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict
 
     progresso = st.progress(0.0, text="Extraindo elementos...")
     processados = 0
+    passo = max(1, total // 100)   # ≤ 100 atualizações da barra por execução
 
     for tipo_ifc, tipo_legivel in TIPOS_ESTRUTURAIS.items():
         elementos = ifc.by_type(tipo_ifc)
@@ -1429,10 +1528,11 @@ def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict
 
         for elem in elementos:
             processados += 1
-            progresso.progress(
-                processados / total,
-                text=f"{tipo_legivel}: {elem.Name or '?'} ({processados}/{total})"
-            )
+            if processados % passo == 0 or processados == total:
+                progresso.progress(
+                    processados / total,
+                    text=f"{tipo_legivel}: {elem.Name or '?'} ({processados}/{total})"
+                )
 
             # Suprimir segmentos de nó de viga (já fundidos ao vão principal)
             if tipo_ifc == "IfcBeam" and elem.id() in NOS_VIGAS:
@@ -1443,9 +1543,9 @@ def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict
                 continue
 
             nome     = elem.Name or "S/N"
-            pavimento = _pavimento(elem)
+            pavimento = pavimentos.get(elem.id(), "Sem pavimento")
             geo      = _bbox(elem)
-            ps       = _psets(elem)
+            ps       = _psets(elem, psets_por_elem.get(elem.id(), []))
 
             # ── Extrair campos específicos dos Psets TQS ──────────────────────
             # Compatibilidade entre versões TQS:
@@ -1553,6 +1653,7 @@ def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict
     progresso.progress(1.0, text="Extração concluída.")
 
     # Ordenação: pavimento → tipo → nome natural
+    # list.sort calcula a chave uma vez por registro (decorate-sort-undecorate)
     registros.sort(key=lambda r: (
         r["Pavimento"],
         r["Tipo_Legivel"],
@@ -1561,6 +1662,37 @@ def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict
     return registros
 
 
+TAMANHO_BLOCO = 1 << 20   # 1 MiB por leitura do upload
+
+
+def hash_upload(arquivo) -> str:
+    """blake2b do upload lido em blocos (chave de processar_ifc_em_cache)."""
+    h = hashlib.blake2b()
+    arquivo.seek(0)
+    for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO), b""):
+        h.update(bloco)
+    arquivo.seek(0)
+    return h.hexdigest()
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def processar_ifc_em_cache(_arquivo, hash_arquivo: str,
+                           nome_projeto: str, id_projeto: str) -> list[dict]:
+    """
+    Processa o IFC do upload, reaproveitando o resultado quando o mesmo arquivo
+    (mesmo hash) é reenviado para a mesma obra. O upload é copiado em blocos
+    para um temp seguro (sempre removido no finally), sem getvalue().
+    """
+    _arquivo.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".ifc") as tmp:
+        shutil.copyfileobj(_arquivo, tmp, TAMANHO_BLOCO)
+        caminho_tmp = tmp.name
+    try:
+        return processar_ifc(caminho_tmp, nome_projeto, id_projeto)
+    finally:
+        os.unlink(caminho_tmp)
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # GERAÇÃO DE PDF (100% em memória — sem arquivos temporários)
 # ──────────────────────────────────────────────────────────────────────────────
@@ -1580,30 +1712,71 @@ def gerar_pdf(registros: list[dict], nome_projeto: str) -> io.BytesIO:
     COLS = 2
 
     c.setTitle(f"Etiquetas BIM — {nome_projeto}")
+    qr = qrcode.QRCode(box_size=8, border=1,
+                       error_correction=qrcode.constants.ERROR_CORRECT_M)
+    # IDs têm o mesmo formato: versão (tamanho) e máscara do mais longo servem a
+    # todos — cada etiqueta pula o ajuste de versão e a avaliação das 8 máscaras
+    if registros:
+        qr.add_data(max((r["ID_Unico"] for r in registros), key=len))
+        # best_fit só fixa a versão; make(fit=True) já avaliaria as 8 máscaras
+        # e best_mask_pattern() as avaliaria de novo
+        qr.best_fit()
+        qr.mask_pattern = qr.best_mask_pattern()
     col, x, y = 0, MH, H_PAG - MV - ALTA
 
+    # Invariantes da etiqueta: calculados uma vez, não por etiqueta
+    COR_BORDA = colors.HexColor("#AAAAAA")
+    COR_DATA  = colors.HexColor("#555555")
+    COR_TEXTO = colors.HexColor("#333333")
+    COR_ARM   = colors.HexColor("#222222")
+    _hoje = datetime.date.today().strftime("%d/%m/%Y")
+    _obra = f"Obra: {nome_projeto[:22]}"
+
+    # Quebra de linha automática em " + " (max 33 chars por linha)
+    def _quebrar(texto, mc=33):
+        if not texto or len(texto) <= mc:
+            return [texto] if texto else []
+        linhas = []
+        while len(texto) > mc:
+            pos = texto.rfind(" + ", 0, mc + 3)
+            if pos > 0:
+                linhas.append(texto[:pos]); texto = texto[pos+3:]
+            else:
+                pos2 = texto.rfind(" ", 0, mc)
+                if pos2 > 0:
+                    linhas.append(texto[:pos2]); texto = texto[pos2+1:]
+                else:
+                    linhas.append(texto[:mc]); texto = texto[mc:]
+        if texto: linhas.append(texto)
+        return linhas
+
+    # Traço da borda: fixo em toda a página, definido na 1ª etiqueta de cada
+    # uma (showPage zera o estado gráfico)
+    nova_pagina = True
     for reg in registros:
         tipo = reg["Tipo_Legivel"]
+        if nova_pagina:
+            c.setStrokeColor(COR_BORDA)
+            c.setLineWidth(0.5)
+            nova_pagina = False
 
         # Fundo branco (sem cor por tipo)
         c.setFillColor(colors.white)
         c.rect(x, y, LARG, ALTA, fill=1, stroke=0)
 
         # Borda
-        c.setStrokeColor(colors.HexColor("#AAAAAA"))
-        c.setLineWidth(0.5)
         c.rect(x, y, LARG, ALTA, fill=0, stroke=1)
 
         # ── QR Code em memória ────────────────────────────────────────────────
-        qr = qrcode.QRCode(box_size=8, border=1,
-                           error_correction=qrcode.constants.ERROR_CORRECT_M)
+        # Objeto reaproveitado; a imagem PIL vai direto ao ImageReader (sem PNG)
+        qr.clear()
         qr.add_data(reg["ID_Unico"])
-        qr.make(fit=True)
+        try:
+            qr.make(fit=False)
+        except qrcode.exceptions.DataOverflowError:
+            qr.make(fit=True)
         img_pil = qr.make_image(fill_color="black", back_color="white")
-        buf_qr = io.BytesIO()
-        img_pil.save(buf_qr, format="PNG")
-        buf_qr.seek(0)
-        c.drawImage(ImageReader(buf_qr),
+        c.drawImage(ImageReader(img_pil.convert("L")),
                     x + 2*mm, y + 7*mm, width=36*mm, height=36*mm)
 
         # ── Pavimento: centralizado acima do QR Code ──────────────────────────
@@ -1613,9 +1786,8 @@ def gerar_pdf(registros: list[dict], nome_projeto: str) -> io.BytesIO:
         c.drawCentredString(_cx_qr, y + 44.5*mm, reg["Pavimento"][:18])
 
         # ── Timestamp: centralizado abaixo do QR Code ─────────────────────────
-        _hoje = datetime.date.today().strftime("%d/%m/%Y")
         c.setFont("Helvetica-Oblique", 5.5)
-        c.setFillColor(colors.HexColor("#555555"))
+        c.setFillColor(COR_DATA)
         c.drawCentredString(_cx_qr, y + 2.5*mm, f"Gerado em: {_hoje}")
 
         # ── Textos lado direito ───────────────────────────────────────────────
@@ -1629,7 +1801,7 @@ def gerar_pdf(registros: list[dict], nome_projeto: str) -> io.BytesIO:
         c.drawString(tx, y + 36*mm, reg["Nome"][:16])
 
         c.setFont("Helvetica", 8)
-        c.setFillColor(colors.HexColor("#333333"))
+        c.setFillColor(COR_TEXTO)
 
         geo_str = reg["Geometria"][:26]
         c.drawString(tx, y + 30*mm, geo_str)
@@ -1648,24 +1820,6 @@ def gerar_pdf(registros: list[dict], nome_projeto: str) -> io.BytesIO:
         # Normalizar "Trans:" → "Transv:" para melhor leitura
         _trans_label = _trans_label.replace("Trans: ", "Transv: ", 1)
 
-        # Quebra de linha automática em " + " (max 33 chars por linha)
-        def _quebrar(texto, mc=33):
-            if not texto or len(texto) <= mc:
-                return [texto] if texto else []
-            linhas = []
-            while len(texto) > mc:
-                pos = texto.rfind(" + ", 0, mc + 3)
-                if pos > 0:
-                    linhas.append(texto[:pos]); texto = texto[pos+3:]
-                else:
-                    pos2 = texto.rfind(" ", 0, mc)
-                    if pos2 > 0:
-                        linhas.append(texto[:pos2]); texto = texto[pos2+1:]
-                    else:
-                        linhas.append(texto[:mc]); texto = texto[mc:]
-            if texto: linhas.append(texto)
-            return linhas
-
         _linhas_long  = _quebrar(_long_label)
         _linhas_trans = _quebrar(_trans_label)
 
@@ -1689,7 +1843,7 @@ def gerar_pdf(registros: list[dict], nome_projeto: str) -> io.BytesIO:
 
         # Desenhar cada linha de armadura
         c.setFont("Helvetica", 6.5)
-        c.setFillColor(colors.HexColor("#222222"))
+        c.setFillColor(COR_ARM)
         for _i, _linha in enumerate(_seq):
             if _linha:  # pular linhas vazias (apenas deslocam o cursor)
                 _ypos = (_INICIO - _i * _step) * mm
@@ -1698,12 +1852,12 @@ def gerar_pdf(registros: list[dict], nome_projeto: str) -> io.BytesIO:
         # Mat e Pavimento ancorados em posições fixas baixas
         _y_mat = min((_INICIO - _n * _step) * mm - 0.5*mm, 8.5*mm)
         c.setFont("Helvetica", 7)
-        c.setFillColor(colors.HexColor("#333333"))
+        c.setFillColor(COR_TEXTO)
         c.drawString(tx, y + _y_mat, f"Mat: {reg['Material'][:20]}")
 
         c.setFont("Helvetica-Bold", 8.5)
         c.setFillColor(colors.black)
-        c.drawString(tx, y + 3*mm, f"Obra: {nome_projeto[:22]}")
+        c.drawString(tx, y + 3*mm, _obra)
 
         # ── Avanço de posição ─────────────────────────────────────────────────
         col += 1
@@ -1715,6 +1869,7 @@ def gerar_pdf(registros: list[dict], nome_projeto: str) -> io.BytesIO:
 
         if y < MV:
             c.showPage()
+            nova_pagina = True
             x, y, col = MH, H_PAG - MV - ALTA, 0
 
     c.save()
@@ -1726,25 +1881,14 @@ def gerar_pdf(registros: list[dict], nome_projeto: str) -> io.BytesIO:
 # PERSISTÊNCIA NO GOOGLE SHEETS
 # ──────────────────────────────────────────────────────────────────────────────
 
-def salvar_no_sheets(client: gspread.Client, id_proj: str,
+def salvar_no_sheets(sh: gspread.Spreadsheet, id_proj: str,
                      nome: str, registros: list[dict]) -> None:
     """
-    Salva projeto e elementos no Google Sheets de forma segura.
-    Estratégia: monta DataFrame completo em memória ANTES de fazer clear().
-    Isso garante que, se houver erro de rede, nenhum dado existente é perdido.
+    Salva projeto e elementos no Google Sheets.
+    Estratégia: troca só as linhas do projeto em Projetos e Elementos
+    (planilhas.sincronizar_abas) — as linhas de outros projetos nunca são
+    reescritas.
     """
-    sh = client.open(NOME_PLANILHA)
-
-    # ── Aba Projetos ──────────────────────────────────────────────────────────
-    try:
-        ws_p = sh.worksheet("Projetos")
-    except gspread.WorksheetNotFound:
-        ws_p = sh.add_worksheet("Projetos", 200, 8)
-
-    df_p = pd.DataFrame(ws_p.get_all_records())
-    if not df_p.empty and "ID_Projeto" in df_p.columns:
-        df_p = df_p[df_p["ID_Projeto"] != id_proj]
-
     tipos_count = Counter(r["Tipo_Legivel"] for r in registros)
 
     novo = {
@@ -1754,35 +1898,11 @@ def salvar_no_sheets(client: gspread.Client, id_proj: str,
         "Total_Elementos":     len(registros),
         "Resumo_Tipos":        " | ".join(f"{t}: {n}" for t, n in tipos_count.items()),
     }
-    df_p = pd.concat([df_p, pd.DataFrame([novo])], ignore_index=True).fillna("").astype(str)
-    ws_p.clear()
-    ws_p.update([df_p.columns.tolist()] + df_p.values.tolist())
-
-    # ── Aba Elementos ─────────────────────────────────────────────────────────
-    try:
-        ws_e = sh.worksheet("Elementos")
-    except gspread.WorksheetNotFound:
-        ws_e = sh.add_worksheet("Elementos", 5000, 25)
-
-    df_e = pd.DataFrame(ws_e.get_all_records())
-    if not df_e.empty and "Projeto_Ref" in df_e.columns:
-        df_e = df_e[df_e["Projeto_Ref"] != id_proj]
-
-    df_novos = pd.DataFrame(registros).fillna("").astype(str)
-
-    # União de colunas (novos podem ter colunas a mais)
-    todas_cols = list(dict.fromkeys(
-        (df_e.columns.tolist() if not df_e.empty else []) +
-        df_novos.columns.tolist()
-    ))
-    if not df_e.empty:
-        df_e = df_e.reindex(columns=todas_cols, fill_value="")
-    df_novos = df_novos.reindex(columns=todas_cols, fill_value="")
 
-    # Monta tudo em memória → só então faz clear()
-    df_final = pd.concat([df_e, df_novos], ignore_index=True).fillna("").astype(str)
-    ws_e.clear()
-    ws_e.update([df_final.columns.tolist()] + df_final.values.tolist())
+    ws_p = obter_aba(sh, "Projetos", [novo])
+    ws_e = obter_aba(sh, "Elementos", registros)
+    sincronizar_abas(sh, id_proj, [(ws_p, "ID_Projeto", [novo]),
+                                   (ws_e, "Projeto_Ref", registros)])
 
 
 # ──────────────────────────────────────────────────────────────────────────────
@@ -1810,7 +1930,7 @@ def _tela_principal() -> None:
     with st.sidebar:
         st.header("Obra")
         nome = st.text_input("Nome da obra", placeholder="Ex: Edifício Residencial Aurora")
-        id_proj = re.sub(r"[^A-Z0-9]", "", nome.upper())[:12] if nome else ""
+        id_proj = REGEX_NAO_CHAVE.sub("", nome.upper())[:12] if nome else ""
         if id_proj:
             st.caption(f"ID interno: `{id_proj}`")
         st.divider()
@@ -1838,15 +1958,9 @@ def _tela_principal() -> None:
         return
 
     if st.button("🚀 Processar IFC", type="primary"):
-        # Salva arquivo em temp seguro (sempre removido no finally)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".ifc") as tmp:
-            tmp.write(arquivo.getvalue())
-            caminho_tmp = tmp.name
-
-        try:
-            registros = processar_ifc(caminho_tmp, nome, id_proj)
-        finally:
-            os.unlink(caminho_tmp)
+        registros = processar_ifc_em_cache(
+            arquivo, hash_upload(arquivo), nome, id_proj
+        )
 
         if not registros:
             return
@@ -1881,9 +1995,10 @@ def _tela_principal() -> None:
     st.divider()
     colunas_view = ["Nome", "Tipo_Legivel", "Pavimento", "Geometria",
                     "Armadura", "Material", "Status"]
-    df_view = pd.DataFrame(filtrados)[
-        [c for c in colunas_view if c in pd.DataFrame(filtrados).columns]
-    ]
+    # Só as colunas exibidas, montadas direto dos dicts (um único DataFrame)
+    cols_view = [c for c in colunas_view if filtrados and c in filtrados[0]]
+    df_view = pd.DataFrame([[r.get(c, "") for c in cols_view] for r in filtrados],
+                           columns=cols_view)
     st.dataframe(df_view, use_container_width=True, height=340)
     st.caption(f"Exibindo {len(filtrados)} de {len(registros)} elementos")
 
@@ -1894,9 +2009,9 @@ def _tela_principal() -> None:
     if col_a.button("☁️ Sincronizar com Google Sheets"):
         try:
             with st.spinner("Conectando..."):
-                client = conectar_sheets()
+                sh = abrir_planilha()
             with st.spinner(f"Salvando {len(registros)} elementos..."):
-                salvar_no_sheets(client, id_proj, nome, registros)
+                salvar_no_sheets(sh, id_proj, nome, registros)
             st.success(f"✅ {len(registros)} elementos sincronizados com sucesso!")
         except Exception as e:
             st.error(f"Erro na sincronização: {e}")
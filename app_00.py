@@ -3,7 +3,9 @@ import os
 import tempfile
 import ifcopenshell
 import ifcopenshell.util.element
-import pandas as pd
+import ifcopenshell.geom
+import multiprocessing
+import numpy as np
 import gspread
 from google.oauth2.service_account import Credentials
 import qrcode
@@ -11,19 +13,23 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 from reportlab.lib import colors
+from reportlab.lib.utils import ImageReader
 import io
+import array
 import datetime
 import re
+import hashlib
+import shutil
+import functools
 from collections import Counter
+from planilhas import obter_aba, sincronizar_abas
 
 # --- CONFIGURAÇÕES ---
 ARQUIVO_CREDENCIAIS = "credenciais.json"
 NOME_PLANILHA_GOOGLE = "Sistema_Conferencia_BIM"
 
-# --- CACHE GLOBAL ---
-CACHE_ARMADURAS_POR_NOME = {}
-
 # --- CONEXÃO ---
+@st.cache_resource
 def conectar_google_sheets():
     scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
     if hasattr(st, "secrets") and "gcp_service_account" in st.secrets:
@@ -36,60 +42,158 @@ def conectar_google_sheets():
         st.stop()
     return gspread.authorize(creds)
 
+@st.cache_resource
+def abrir_planilha():
+    """Planilha aberta uma vez por processo (client.open busca o arquivo no Drive a cada chamada)."""
+    return conectar_google_sheets().open(NOME_PLANILHA_GOOGLE)
+
+# Tudo que não é letra/dígito (Unicode, como str.isalnum) — removido em C pelo re
+REGEX_NAO_ALFANUM = re.compile(r'[\W_]+')
+
+@functools.lru_cache(maxsize=4096)
 def limpar_string(texto):
     if not texto: return "X"
-    return "".join(e for e in str(texto) if e.isalnum()).upper()
+    return REGEX_NAO_ALFANUM.sub('', str(texto)).upper()
 
 # --- ARMADURA (MÉTODO TQS / REGEX) ---
+# Nome TQS da barra: "QTD PILAR ... BITOLA ..." -> grupos (qtd, pilar, bitola)
+# A bitola é o primeiro decimal após o nome do pilar (opcional).
+REGEX_BARRA_PILAR = re.compile(r'^(\d+)\s+(P\d+)\s(?:.*?([0-9]+\.[0-9]+))?', re.DOTALL)
+
 def indexar_todas_armaduras(ifc_file):
-    global CACHE_ARMADURAS_POR_NOME
-    CACHE_ARMADURAS_POR_NOME = {}
-    barras = ifc_file.by_type('IfcReinforcingBar')
+    """Retorna {nome_pilar: Counter({bitola: qtd})} (por arquivo, sem estado global)."""
+    armaduras = {}
+    barras = ifc_file.by_type('IfcReinforcingBar', include_subtypes=False)
     
     for bar in barras:
         nome_completo = bar.Name 
         if not nome_completo: continue
         
-        match_nome = re.search(r'^\d+\s+(P\d+)\s', nome_completo)
+        match_barra = REGEX_BARRA_PILAR.match(nome_completo)
         
-        if match_nome:
-            nome_pilar = match_nome.group(1)
-            bitola = 0.0
-            
-            try:
-                resto_string = nome_completo.split(nome_pilar, 1)[1]
-                match_bitola = re.search(r'([0-9]+\.[0-9]+)', resto_string)
-                if match_bitola:
-                    bitola = float(match_bitola.group(1))
-            except:
-                pass
-            
-            if bitola == 0.0 and hasattr(bar, "NominalDiameter") and bar.NominalDiameter:
-                bitola = bar.NominalDiameter * 1000 
+        if match_barra:
+            qtd_txt, nome_pilar, bitola_txt = match_barra.groups()
+            qtd_barra = int(qtd_txt)
+            bitola = float(bitola_txt) if bitola_txt else 0.0
             
-            qtd_barra = 1
-            match_qtd = re.search(r'^(\d+)\s+P', nome_completo)
-            if match_qtd:
-                qtd_barra = int(match_qtd.group(1))
+            if bitola == 0.0:
+                diametro = getattr(bar, "NominalDiameter", None)  # um acesso só (atributo opcional no IFC4)
+                if diametro: bitola = diametro * 1000
 
             if bitola > 0:
-                if nome_pilar not in CACHE_ARMADURAS_POR_NOME:
-                    CACHE_ARMADURAS_POR_NOME[nome_pilar] = []
-                for _ in range(qtd_barra):
-                    CACHE_ARMADURAS_POR_NOME[nome_pilar].append(bitola)
-
-def obter_armadura_do_cache(nome_pilar):
-    if nome_pilar not in CACHE_ARMADURAS_POR_NOME:
-        return "Verificar Detalhamento"
-    lista_bitolas = CACHE_ARMADURAS_POR_NOME[nome_pilar]
-    c = Counter(lista_bitolas)
-    return " + ".join([f"{qtd} ø{diam:.1f}" for diam, qtd in sorted(c.items(), key=lambda item: item[0], reverse=True)])
+                armaduras.setdefault(nome_pilar, Counter())[bitola] += qtd_barra
+    return armaduras
+
+def formatar_armadura(c):
+    # Bitolas são chaves únicas do Counter: ordenar os pares já ordena pela bitola
+    return " + ".join(f"{qtd} ø{diam:.1f}" for diam, qtd in sorted(c.items(), reverse=True))
+
+def obter_armadura_do_cache(nome_pilar, armaduras):
+    """armaduras: {nome_pilar: texto} já formatado uma vez por nome em processar_ifc."""
+    return armaduras.get(nome_pilar, "Verificar Detalhamento")
 
 # --- GEOMETRIA E QUANTITATIVOS (MELHORIA BASEADA NO ARTIGO) ---
 
-def extrair_dados_geometricos(pilar):
+def calcular_bbox_pilares(ifc_file, pilares):
+    """
+    Tessela todos os pilares numa única passada do kernel geométrico do
+    IfcOpenShell (C++, multithread) e retorna {GlobalId: (minimos, maximos)}.
+    Coordenadas locais do pilar e na unidade do arquivo (cm no TQS), como na
+    varredura 3D de extrair_dados_geometricos — que é usada pelos pilares que
+    o kernel não processar (ficam fora do dict). Em coordenadas globais a
+    caixa alinhada aos eixos do mundo incharia a seção de pilares rotacionados.
+    Diferente da varredura, o kernel resolve IfcExtrudedAreaSolid: a altura
+    desses pilares sai da profundidade da extrusão (a varredura dava 0).
+    """
+    bboxes = {}
+    if not pilares: return bboxes
+
+    settings = ifcopenshell.geom.settings()
+    settings.set(settings.CONVERT_BACK_UNITS, True)
+    try:
+        iterador = ifcopenshell.geom.iterator(settings, ifc_file, multiprocessing.cpu_count(), include=pilares)
+        if not iterador.initialize(): return bboxes
+        while True:
+            shape = iterador.get()
+            verts = np.asarray(shape.geometry.verts, dtype=np.float64).reshape(-1, 3)
+            if verts.size:
+                bboxes[shape.guid] = (verts.min(axis=0), verts.max(axis=0))
+            if not iterador.next(): break
+    except RuntimeError as e:  # erro do kernel C++ (OCC/parser); demais erros sobem
+        st.warning(f"Kernel geométrico falhou, usando varredura: {e}")
+    return bboxes
+
+def valores_pset(pset):
+    """{propriedade: valor} das IfcPropertySingleValue de um IfcPropertySet."""
+    return {
+        p.Name: (p.NominalValue.wrappedValue if p.NominalValue else None)
+        for p in pset.HasProperties if p.is_a('IfcPropertySingleValue')
+    }
+
+def definicoes_rel(rel):
+    """Definições de um IfcRelDefinesByProperties (no IFC4 pode ser uma tupla — IfcPropertySetDefinitionSet)."""
+    d = rel.RelatingPropertyDefinition
+    return d if isinstance(d, (list, tuple)) else (d,)
+
+def obter_pset(elemento, nome_pset):
+    """
+    Lê um único Pset pelo nome direto de IsDefinedBy, sem materializar todos
+    os Psets do elemento como ifcopenshell.util.element.get_psets faz.
+    Como get_psets, herda o Pset do tipo (HasPropertySets), sobrescrito
+    propriedade a propriedade pelo da ocorrência.
+    Retorna {propriedade: valor} ou None se o Pset não existir.
+    """
+    valores = None
+    tipo = ifcopenshell.util.element.get_type(elemento)
+    for pset in (getattr(tipo, 'HasPropertySets', None) or ()):
+        if pset.is_a('IfcPropertySet') and pset.Name == nome_pset:
+            valores = valores_pset(pset)
+            break
+    for rel in elemento.IsDefinedBy or []:
+        if not rel.is_a('IfcRelDefinesByProperties'): continue
+        for pset in definicoes_rel(rel):
+            if pset.is_a('IfcPropertySet') and pset.Name == nome_pset:
+                return {**(valores or {}), **valores_pset(pset)}
+    return valores
+
+def mapear_pset(ifc_file, nome_pset):
+    """
+    {GlobalId: {propriedade: valor}} de um Pset numa passada por
+    IfcRelDefinesByType e outra por IfcRelDefinesByProperties. Elementos sem o
+    Pset ficam fora do dict, e um arquivo sem ele (ex.: IFC que não veio do
+    TQS) custa só essas passadas.
+    Como get_psets, o Pset do tipo (IfcRelDefinesByType → HasPropertySets)
+    é herdado e sobrescrito propriedade a propriedade pelo da ocorrência.
+    """
+    def coletar(rels, definicoes):
+        achados = {}
+        for rel in rels:
+            for pset in definicoes(rel):
+                if not (pset.is_a('IfcPropertySet') and pset.Name == nome_pset): continue
+                valores = valores_pset(pset)
+                for elem in rel.RelatedObjects:
+                    achados.setdefault(elem.GlobalId, valores)
+        return achados
+
+    psets = coletar(ifc_file.by_type('IfcRelDefinesByType'),
+                    lambda rel: rel.RelatingType.HasPropertySets or ())
+    ocorrencias = coletar(ifc_file.by_type('IfcRelDefinesByProperties'), definicoes_rel)
+    for guid, valores in ocorrencias.items():
+        psets[guid] = {**psets[guid], **valores} if guid in psets else valores
+    return psets
+
+# Varredura 3D (fallback do kernel): atributos que levam aos IfcCartesianPoint.
+# Quais deles cada classe IFC possui é resolvido uma vez por classe (hasattr
+# custa uma exceção quando falta) e fica em ATRIBUTOS_POR_CLASSE — depende só do schema.
+REPRESENTACOES_GEOMETRIA = ('Body', 'Mesh', 'Box', 'Facetation')
+ATRIBUTOS_GEOMETRIA = ('Points', 'OuterCurve', 'PolygonalBoundary', 'FbsmFaces', 'CfsFaces', 'Bounds', 'Bound', 'Items', 'MappingSource', 'MappedRepresentation', 'Polygon', 'SweptArea')
+ATRIBUTOS_POR_CLASSE = {}
+
+def extrair_dados_geometricos(pilar, bbox=None, pset_geo=None):
     """
     Retorna um dicionário com: Seção, Altura Estimada, Coordenadas (X,Y)
+    bbox: (minimos, maximos) já calculado por calcular_bbox_pilares, se houver.
+    pset_geo: TQS_Geometria já lido por mapear_pset ({} = pilar sem o Pset).
     """
     resultado = {
         "secao": "N/A", 
@@ -101,9 +205,8 @@ def extrair_dados_geometricos(pilar):
     }
 
     # 1. Tenta Psets TQS
-    psets = ifcopenshell.util.element.get_psets(pilar)
-    if 'TQS_Geometria' in psets:
-        d = psets['TQS_Geometria']
+    d = obter_pset(pilar, 'TQS_Geometria') if pset_geo is None else pset_geo
+    if d:
         b = d.get('Dimensao_b1') or d.get('B')
         h = d.get('Dimensao_h1') or d.get('H')
         if b and h:
@@ -113,65 +216,70 @@ def extrair_dados_geometricos(pilar):
             resultado["largura_cm"] = vals[0]
             resultado["profundidade_cm"] = vals[1]
 
-    # 2. Varredura 3D (Bounding Box)
-    if not pilar.Representation: return resultado
-    
-    pontos_x, pontos_y, pontos_z = [], [], []
-    
-    def coletar_pontos(item):
-        if item is None: return
-        if isinstance(item, (list, tuple)):
-            for i in item: coletar_pontos(i)
-            return
-        if not hasattr(item, 'is_a'): return
-
-        if item.is_a('IfcCartesianPoint') and hasattr(item, 'Coordinates'):
-            c = item.Coordinates
-            if len(c) >= 3:
-                pontos_x.append(c[0])
-                pontos_y.append(c[1])
-                pontos_z.append(c[2])
-            return
-
-        atributos = ['Points', 'OuterCurve', 'PolygonalBoundary', 'FbsmFaces', 'CfsFaces', 'Bounds', 'Bound', 'Items', 'MappingSource', 'MappedRepresentation', 'Polygon', 'SweptArea']
-        for attr in atributos:
-            if hasattr(item, attr):
-                coletar_pontos(getattr(item, attr))
-
-    for rep in pilar.Representation.Representations:
-        if rep.RepresentationIdentifier in ['Body', 'Mesh', 'Box', 'Facetation']:
-            for item in rep.Items:
-                coletar_pontos(item)
-    
-    if pontos_x and pontos_y and pontos_z:
-        try:
-            min_x, max_x = min(pontos_x), max(pontos_x)
-            min_y, max_y = min(pontos_y), max(pontos_y)
-            min_z, max_z = min(pontos_z), max(pontos_z)
-
-            largura = max_x - min_x
-            profundidade = max_y - min_y
-            altura = max_z - min_z
-            
-            # Centroide aproximado
-            resultado["coord_x"] = round((min_x + max_x) / 2, 2)
-            resultado["coord_y"] = round((min_y + max_y) / 2, 2)
-            resultado["altura"] = round(altura, 2) # Altura em metros (IFC padrão)
-
-            # Ajuste de escala para seção (metros -> cm)
-            if largura < 3.0: largura *= 100
-            if profundidade < 3.0: profundidade *= 100
-            
-            dims = sorted([largura, profundidade])
+    # 2. Bounding Box: kernel geométrico (pré-calculado) ou varredura 3D
+    if bbox is not None:
+        minimos, maximos = bbox
+    else:
+        if not pilar.Representation: return resultado
+        
+        pontos = array.array('d')  # x,y,z contíguos em float64 (sem uma tupla por ponto)
+        
+        # Varredura iterativa (pilha explícita, sem recursão Python)
+        pilha = [item for rep in pilar.Representation.Representations
+                 if rep.RepresentationIdentifier in REPRESENTACOES_GEOMETRIA
+                 for item in rep.Items]
+        while pilha:
+            item = pilha.pop()
+            if item is None: continue
+            if isinstance(item, (list, tuple)):
+                pilha.extend(item)
+                continue
+            if not hasattr(item, 'is_a'): continue
+
+            classe = item.is_a()
+            if classe == 'IfcCartesianPoint':
+                c = item.Coordinates
+                if len(c) >= 3:
+                    pontos.extend(c[:3])
+                continue
+
+            atributos = ATRIBUTOS_POR_CLASSE.get(classe)
+            if atributos is None:
+                atributos = ATRIBUTOS_POR_CLASSE[classe] = tuple(a for a in ATRIBUTOS_GEOMETRIA if hasattr(item, a))
+            for attr in atributos:
+                pilha.append(getattr(item, attr))
+        
+        if not pontos: return resultado
+        arr = np.frombuffer(pontos, dtype=np.float64).reshape(-1, 3)
+        minimos, maximos = arr.min(axis=0), arr.max(axis=0)
+
+    try:
+        min_x, min_y, min_z = map(float, minimos)
+        max_x, max_y, max_z = map(float, maximos)
+
+        largura = max_x - min_x
+        profundidade = max_y - min_y
+        altura = max_z - min_z
+        
+        # Centroide aproximado
+        resultado["coord_x"] = round((min_x + max_x) / 2, 2)
+        resultado["coord_y"] = round((min_y + max_y) / 2, 2)
+        resultado["altura"] = round(altura, 2) # Altura em metros (IFC padrão)
+
+        # Ajuste de escala para seção (metros -> cm)
+        if largura < 3.0: largura *= 100
+        if profundidade < 3.0: profundidade *= 100
+        
+        dims = sorted([largura, profundidade])
+        
+        # Só atualiza se não achou via Pset
+        if resultado["secao"] == "N/A":
+            resultado["secao"] = f"{dims[0]:.0f}x{dims[1]:.0f}"
+            resultado["largura_cm"] = dims[0]
+            resultado["profundidade_cm"] = dims[1]
             
-            # Só atualiza se não achou via Pset
-            if resultado["secao"] == "N/A":
-                resultado["secao"] = f"{dims[0]:.0f}x{dims[1]:.0f}"
-                resultado["largura_cm"] = dims[0]
-                resultado["profundidade_cm"] = dims[1]
-                
-        except:
-            pass
+    except:
+        pass
             
     return resultado
 
@@ -186,63 +294,148 @@ def extrair_material(pilar):
     return "Concreto" # Padrão se não achar
 
 # --- ORDENAÇÃO ---
+REGEX_DIGITOS = re.compile(r'(\d+)')
+
+@functools.lru_cache(maxsize=4096)
 def natural_keys(text):
-    return [int(c) if c.isdigit() else c for c in re.split(r'(\d+)', text)]
+    # Tupla: imutável (segura para o cache) e mais rápida de comparar que lista
+    return tuple(int(c) if c.isdigit() else c for c in REGEX_DIGITOS.split(text))
+
+def mapear_pavimentos(ifc_file):
+    """{GlobalId: nome do pavimento} numa única passada pelas relações espaciais."""
+    return {
+        elem.GlobalId: rel.RelatingStructure.Name
+        for rel in ifc_file.by_type('IfcRelContainedInSpatialStructure')
+        for elem in rel.RelatedElements
+    }
+
+def mapear_materiais(ifc_file):
+    """
+    {GlobalId: nome do material} numa única passada por IfcRelAssociatesMaterial:
+    cada material é lido uma vez e replicado para todos os elementos associados.
+    """
+    materiais = {}
+    for rel in ifc_file.by_type('IfcRelAssociatesMaterial'):
+        nome = getattr(rel.RelatingMaterial, 'Name', None)
+        if not nome: continue
+        for elem in rel.RelatedObjects:
+            materiais[elem.GlobalId] = nome
+    return materiais
+
+def extrair_dados_pilar(pilar, id_projeto_input, armaduras, pavimento="Térreo", bbox=None, material=None, pset_geo=None):
+    """Monta o registro de um pilar (uma linha da aba Pilares)."""
+    guid = pilar.GlobalId
+    nome = pilar.Name if pilar.Name else "S/N"
+    
+    sufixo_pav = limpar_string(pavimento)
+    sufixo_nome = limpar_string(nome)
+    id_unico_pilar = f"{sufixo_nome}-{guid}-{sufixo_pav}-{id_projeto_input}"
+
+    # Extração Geométrica Avançada (Com Volume)
+    geo = extrair_dados_geometricos(pilar, bbox, pset_geo)
+    armadura = obter_armadura_do_cache(nome, armaduras)
+    material = material or extrair_material(pilar)  # fallback: material herdado do tipo
+    
+    # Cálculo de Volume Estimado (Seção em cm * Altura em m)
+    volume_estimado = 0.0
+    if geo["largura_cm"] > 0 and geo["profundidade_cm"] > 0 and geo["altura"] > 0:
+        area_m2 = (geo["largura_cm"] / 100) * (geo["profundidade_cm"] / 100)
+        volume_estimado = round(area_m2 * geo["altura"], 3) # m³
+
+    return {
+        'ID_Unico': id_unico_pilar,   
+        'Projeto_Ref': id_projeto_input, 
+        'Nome': nome, 
+        'Secao': geo["secao"],
+        'Altura_m': geo["altura"],
+        'Volume_Concreto_m3': volume_estimado,
+        'Material': material,
+        'Armadura': armadura, 
+        'Pavimento': pavimento,
+        'Coord_X': geo["coord_x"],
+        'Coord_Y': geo["coord_y"],
+        'Status': 'A CONFERIR', 
+        'Data_Conferencia': '', 
+        'Responsavel': ''
+    }
 
 def processar_ifc(caminho_arquivo, id_projeto_input):
     ifc_file = ifcopenshell.open(caminho_arquivo)
-    indexar_todas_armaduras(ifc_file)
+    # Formata uma vez por nome: o mesmo P1 se repete em vários pavimentos
+    armaduras = {nome: formatar_armadura(c) for nome, c in indexar_todas_armaduras(ifc_file).items()}
     pilares = ifc_file.by_type('IfcColumn')
+    # Parte paralela: tesselação no kernel C++ (multithread). O restante lê
+    # entidades do ifcopenshell, que não é thread-safe, e segue sequencial.
+    bboxes = calcular_bbox_pilares(ifc_file, pilares)
+    pavimentos = mapear_pavimentos(ifc_file)
+    materiais = mapear_materiais(ifc_file)
+    psets_geo = mapear_pset(ifc_file, 'TQS_Geometria')
     dados = []
     
     progresso = st.progress(0)
     total = len(pilares)
+    passo = max(1, total // 100)  # ~100 atualizações no máximo (cada uma é um round-trip ao navegador)
     
     for i, pilar in enumerate(pilares):
-        progresso.progress((i + 1) / total)
+        if i % passo == 0 or i == total - 1:
+            progresso.progress((i + 1) / total)
         guid = pilar.GlobalId
-        nome = pilar.Name if pilar.Name else "S/N"
-        
-        pavimento = "Térreo"
-        if pilar.ContainedInStructure:
-            pavimento = pilar.ContainedInStructure[0].RelatingStructure.Name
-        
-        sufixo_pav = limpar_string(pavimento)
-        sufixo_nome = limpar_string(nome)
-        id_unico_pilar = f"{sufixo_nome}-{guid}-{sufixo_pav}-{id_projeto_input}"
-
-        # Extração Geométrica Avançada (Com Volume)
-        geo = extrair_dados_geometricos(pilar)
-        armadura = obter_armadura_do_cache(nome)
-        material = extrair_material(pilar)
-        
-        # Cálculo de Volume Estimado (Seção em cm * Altura em m)
-        volume_estimado = 0.0
-        if geo["largura_cm"] > 0 and geo["profundidade_cm"] > 0 and geo["altura"] > 0:
-            area_m2 = (geo["largura_cm"] / 100) * (geo["profundidade_cm"] / 100)
-            volume_estimado = round(area_m2 * geo["altura"], 3) # m³
-
-        dados.append({
-            'ID_Unico': id_unico_pilar,   
-            'Projeto_Ref': id_projeto_input, 
-            'Nome': nome, 
-            'Secao': geo["secao"],
-            'Altura_m': geo["altura"],
-            'Volume_Concreto_m3': volume_estimado,
-            'Material': material,
-            'Armadura': armadura, 
-            'Pavimento': pavimento,
-            'Coord_X': geo["coord_x"],
-            'Coord_Y': geo["coord_y"],
-            'Status': 'A CONFERIR', 
-            'Data_Conferencia': '', 
-            'Responsavel': ''
-        })
+        dados.append(extrair_dados_pilar(pilar, id_projeto_input, armaduras, pavimentos.get(guid, "Térreo"), bboxes.get(guid), materiais.get(guid), psets_geo.get(guid, {})))
     
     dados.sort(key=lambda x: (x['Pavimento'], natural_keys(x['Nome'])))
     return dados
 
+TAMANHO_BLOCO = 1 << 20  # 1 MiB por leitura do upload
+
+def hash_upload(arquivo):
+    """blake2b do upload lido em blocos (chave do cache de processar_ifc_em_cache)."""
+    h = hashlib.blake2b()
+    arquivo.seek(0)
+    for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO), b""):
+        h.update(bloco)
+    arquivo.seek(0)
+    return h.hexdigest()
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def processar_ifc_em_cache(_arquivo_ifc, hash_arquivo, id_projeto_input):
+    """
+    Processa o IFC do upload, reaproveitando o resultado quando o mesmo arquivo
+    (mesmo hash) é reenviado para o mesmo projeto. O upload é copiado ao
+    arquivo temporário em blocos, sem montar uma segunda cópia em memória.
+    """
+    _arquivo_ifc.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".ifc") as t:
+        shutil.copyfileobj(_arquivo_ifc, t, TAMANHO_BLOCO)
+        path = t.name
+    try:
+        return processar_ifc(path, id_projeto_input)
+    finally:
+        os.remove(path)
+
 # --- PDF (LAYOUT RÍGIDO) ---
+def parametros_qr(conteudo):
+    """Menor versão (tamanho) de QR Code que comporta o conteúdo e a melhor máscara para ele."""
+    qr = qrcode.QRCode(box_size=10, border=0)
+    qr.add_data(conteudo)
+    qr.best_fit()  # só a versão; a máscara é avaliada uma única vez abaixo
+    return qr.version, qr.best_mask_pattern()
+
+def gerar_qr_imagem(conteudo, versao=None, mascara=None):
+    """
+    QR Code em memória (sem PNG em disco). Sem cache: cada ID_Unico aparece em uma só
+    etiqueta, e um cache de módulo manteria os bitmaps vivos entre sessões. Com versão e máscara fixadas pelo ID mais longo da etiquetagem, pula a busca de
+    tamanho (fit) e a avaliação das 8 máscaras, que é a etapa cara do qrcode.
+    """
+    qr = qrcode.QRCode(version=versao, box_size=10, border=0, mask_pattern=mascara)
+    qr.add_data(conteudo)
+    try:
+        qr.make(fit=versao is None)
+    except qrcode.exceptions.DataOverflowError:
+        qr.make(fit=True)
+    img_qr = qr.make_image(fill_color="black", back_color="white")
+    # Tons de cinza ('L'): 1 byte/pixel no PDF. O reportlab converte modo '1' para RGB (3 bytes)
+    return ImageReader(img_qr.convert('L'))
+
 def gerar_pdf_memoria(dados_pilares, nome_projeto_legivel):
     buffer = io.BytesIO()
     c = canvas.Canvas(buffer, pagesize=A4)
@@ -256,54 +449,64 @@ def gerar_pdf_memoria(dados_pilares, nome_projeto_legivel):
     coluna_atual = 0
     c.setTitle(f"Etiquetas - {nome_projeto_legivel}")
     
-    for i, pilar in enumerate(dados_pilares):
+    # Todos os IDs têm o mesmo formato: versão e máscara do mais longo servem para todos
+    versao, mascara = parametros_qr(max((p['ID_Unico'] for p in dados_pilares), key=len)) if dados_pilares else (None, None)
+    
+    # Posição de cada etiqueta, agrupada por página
+    paginas = [[]]
+    for pilar in dados_pilares:
+        paginas[-1].append((pilar, x, y))
+        coluna_atual += 1
+        if coluna_atual > 1:
+            coluna_atual = 0
+            x = MARGEM_ESQ
+            y -= (ALTURA_ETQ + ESPACO_Y)
+        else:
+            x += (LARGURA_ETQ + ESPACO_X)
+        if y < MARGEM_SUP:
+            paginas.append([])
+            y = altura_pag - MARGEM_SUP - ALTURA_ETQ
+            x = MARGEM_ESQ
+            coluna_atual = 0
+    paginas = [p for p in paginas if p]
+    
+    # Desenho agrupado por estilo: cada fonte/cor/traço é definido uma vez por
+    # página (showPage zera o estado gráfico), não uma vez por etiqueta
+    rodape = f"Obra: {nome_projeto_legivel[:18]}..."
+    for n, etiquetas in enumerate(paginas):
+        if n: c.showPage()
+        
         c.setLineWidth(1)
         c.setStrokeColor(colors.black)
-        c.rect(x, y, LARGURA_ETQ, ALTURA_ETQ)
-        
-        qr = qrcode.QRCode(box_size=10, border=0)
-        qr.add_data(pilar['ID_Unico'])
-        qr.make(fit=True)
-        img_qr = qr.make_image(fill_color="black", back_color="white")
-        temp_qr_path = f"temp_{i}.png"
-        img_qr.save(temp_qr_path)
-        c.drawImage(temp_qr_path, x + 3*mm, y + 7.5*mm, width=35*mm, height=35*mm)
-        os.remove(temp_qr_path)
+        for pilar, x, y in etiquetas:
+            c.rect(x, y, LARGURA_ETQ, ALTURA_ETQ)
+            c.drawImage(gerar_qr_imagem(pilar['ID_Unico'], versao, mascara), x + 3*mm, y + 7.5*mm, width=35*mm, height=35*mm)
         
-        texto_x = x + 42*mm
         c.setFont("Helvetica-Bold", 16)
-        c.drawString(texto_x, y + 38*mm, f"PILAR: {pilar['Nome']}")
+        for pilar, x, y in etiquetas:
+            c.drawString(x + 42*mm, y + 38*mm, f"PILAR: {pilar['Nome']}")
         
         # Dados Técnicos Expandidos na Etiqueta
         c.setFont("Helvetica", 10)
-        c.drawString(texto_x, y + 31*mm, f"Sec: {pilar['Secao']} | H: {pilar['Altura_m']}m")
-        c.drawString(texto_x, y + 27*mm, f"Vol: {pilar['Volume_Concreto_m3']} m³")
+        for pilar, x, y in etiquetas:
+            c.drawString(x + 42*mm, y + 31*mm, f"Sec: {pilar['Secao']} | H: {pilar['Altura_m']}m")
+            c.drawString(x + 42*mm, y + 27*mm, f"Vol: {pilar['Volume_Concreto_m3']} m³")
         
         c.setFont("Helvetica-Bold", 11)
-        c.drawString(texto_x, y + 19*mm, f"{pilar['Pavimento']}")
+        for pilar, x, y in etiquetas:
+            c.drawString(x + 42*mm, y + 19*mm, f"{pilar['Pavimento']}")
         
         c.setFont("Helvetica-Oblique", 8)
         c.setFillColor(colors.gray)
-        c.drawString(texto_x, y + 8*mm, f"Obra: {nome_projeto_legivel[:18]}...")
+        for pilar, x, y in etiquetas:
+            c.drawString(x + 42*mm, y + 8*mm, rodape)
         c.setFillColor(colors.black)
         
         c.setDash(3, 3)
         c.setLineWidth(0.2)
-        c.rect(x-1*mm, y-1*mm, LARGURA_ETQ+2*mm, ALTURA_ETQ+2*mm)
+        for pilar, x, y in etiquetas:
+            c.rect(x-1*mm, y-1*mm, LARGURA_ETQ+2*mm, ALTURA_ETQ+2*mm)
         c.setDash()
-        
-        coluna_atual += 1
-        if coluna_atual > 1:
-            coluna_atual = 0
-            x = MARGEM_ESQ
-            y -= (ALTURA_ETQ + ESPACO_Y)
-        else:
-            x += (LARGURA_ETQ + ESPACO_X)
-        if y < MARGEM_SUP:
-            c.showPage()
-            y = altura_pag - MARGEM_SUP - ALTURA_ETQ
-            x = MARGEM_ESQ
-            coluna_atual = 0
     c.save()
     buffer.seek(0)
     return buffer
@@ -328,25 +531,15 @@ def main():
     if f and nome:
         if st.button("🚀 PROCESSAR DADOS"):
             try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".ifc") as t:
-                    t.write(f.getvalue())
-                    path = t.name
+                hash_arquivo = hash_upload(f)
                 
                 with st.spinner('Minerando dados (Geometria + Armadura + Volume)...'):
-                    dados = processar_ifc(path, id_proj)
-                os.remove(path)
+                    dados = processar_ifc_em_cache(f, hash_arquivo, id_proj)
                 
                 with st.spinner('Sincronizando Banco de Dados...'):
-                    client = conectar_google_sheets()
-                    sh = client.open(NOME_PLANILHA_GOOGLE)
+                    sh = abrir_planilha()
                     
                     # PROJETOS
-                    try: ws_p = sh.worksheet("Projetos")
-                    except: ws_p = sh.add_worksheet("Projetos", 100, 5)
-                    recs = ws_p.get_all_records()
-                    df = pd.DataFrame(recs)
-                    if not df.empty and 'ID_Projeto' in df.columns: df = df[df['ID_Projeto'] != id_proj]
-                    
                     # Calcula volume total da obra para salvar no projeto
                     vol_total = sum(d['Volume_Concreto_m3'] for d in dados)
                     
@@ -356,22 +549,16 @@ def main():
                         'Total_Pilares': len(dados),
                         'Volume_Total_Concreto': round(vol_total, 2)
                     }
-                    df_final = pd.concat([df, pd.DataFrame([new])], ignore_index=True).fillna("").astype(str)
-                    ws_p.clear()
-                    ws_p.update([df_final.columns.values.tolist()] + df_final.values.tolist())
 
+                    ws_p = obter_aba(sh, "Projetos", [new])
                     # PILARES
-                    try: ws_pil = sh.worksheet("Pilares")
-                    except: ws_pil = sh.add_worksheet("Pilares", 1000, 10)
-                    recs = ws_pil.get_all_records()
-                    df = pd.DataFrame(recs)
-                    if not df.empty and 'Projeto_Ref' in df.columns: df = df[df['Projeto_Ref'] != id_proj]
-                    
-                    df_pil_final = pd.concat([df, pd.DataFrame(dados)], ignore_index=True)
-                    df_pil_final = df_pil_final.fillna("").astype(str)
+                    ws_pil = obter_aba(sh, "Pilares", dados)
                     
-                    ws_pil.clear()
-                    ws_pil.update([df_pil_final.columns.values.tolist()] + df_pil_final.values.tolist())
+                    # Projetos + Pilares: leituras em lote e uma única gravação
+                    sincronizar_abas(sh, id_proj, [
+                        (ws_p, 'ID_Projeto', [new]),
+                        (ws_pil, 'Projeto_Ref', dados),
+                    ])
                 
                 with st.spinner('Gerando PDF...'):
                     pdf = gerar_pdf_memoria(dados, nome)
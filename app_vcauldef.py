@@ -27,11 +27,12 @@ Estrutura de Psets TQS confirmada neste modelo:
 """
 
 import streamlit as st
-import os, re, io, tempfile, datetime
+import os, re, io, tempfile, datetime, array, shutil, hashlib
 from collections import defaultdict, Counter
 
 import ifcopenshell
 import ifcopenshell.util.element
+import numpy as np
 import pandas as pd
 import gspread
 from google.oauth2.service_account import Credentials
@@ -42,6 +43,8 @@ from reportlab.lib.units import mm
 from reportlab.lib import colors
 from reportlab.lib.utils import ImageReader
 
+from planilhas import obter_aba, sincronizar_abas
+
 
 # ──────────────────────────────────────────────────────────────────────────────
 # CONSTANTES
@@ -71,6 +74,19 @@ REGEX_BARRA = re.compile(
     re.UNICODE
 )
 
+# Escapes de string IFC — compilados uma vez (decode_ifc roda por barra/Pset)
+REGEX_IFC_X2 = re.compile(r'\\X2\\([0-9A-Fa-f]{4})\\X0\\')
+REGEX_IFC_S  = re.compile(r'\\S\\(.)')
+
+# Caracteres fora de [A-Z0-9] — removidos das chaves (ID_Unico, ID da obra)
+REGEX_NAO_CHAVE = re.compile(r"[^A-Z0-9]")
+
+# Wrappers de tipo IFC em limpar_valor (roda para cada propriedade de cada Pset)
+REGEX_IFC_TEXTO    = re.compile(r"IFC(?:LABEL|TEXT|IDENTIFIER)\('(.*)'\)$", re.DOTALL)
+REGEX_IFC_MEDIDA   = re.compile(r"IFC\w+MEASURE\((.+)\)$")
+REGEX_IFC_BOOLEANO = re.compile(r"IFCBOOLEAN\(\.([TF])\.\)$")
+REGEX_IFC_NUMERO   = re.compile(r"IFC(?:INTEGER|REAL|COUNTMEASURE)\((.+)\)$")
+
 
 # ──────────────────────────────────────────────────────────────────────────────
 # DECODIFICAÇÃO DE STRINGS IFC
@@ -85,17 +101,9 @@ def decode_ifc(texto: str) -> str:
     if not texto:
         return ""
     # Sequência Unicode \X2\HHHH\X0\
-    texto = re.sub(
-        r'\\X2\\([0-9A-Fa-f]{4})\\X0\\',
-        lambda m: chr(int(m.group(1), 16)),
-        texto
-    )
+    texto = REGEX_IFC_X2.sub(lambda m: chr(int(m.group(1), 16)), texto)
     # Sequência ISO-8859-1 \S\x
-    texto = re.sub(
-        r'\\S\\(.)',
-        lambda m: chr(0x80 + ord(m.group(1))),
-        texto
-    )
+    texto = REGEX_IFC_S.sub(lambda m: chr(0x80 + ord(m.group(1))), texto)
     return texto
 
 
@@ -104,23 +112,26 @@ def limpar_valor(valor: str) -> str:
     if not valor or valor.strip() == '$':
         return ""
     v = valor.strip()
+    if not v.startswith("IFC"):
+        # Valor nu (sem wrapper) — caso mais comum, nenhum padrão abaixo casa
+        return decode_ifc(v.strip("'"))
     # IFCLABEL / IFCTEXT / IFCIDENTIFIER com aspas
-    m = re.match(r"IFC(?:LABEL|TEXT|IDENTIFIER)\('(.*)'\)$", v, re.DOTALL)
+    m = REGEX_IFC_TEXTO.match(v)
     if m:
         return decode_ifc(m.group(1))
     # Medidas numéricas
-    m = re.match(r"IFC\w+MEASURE\((.+)\)$", v)
+    m = REGEX_IFC_MEDIDA.match(v)
     if m:
         try:
             return str(round(float(m.group(1)), 4))
         except ValueError:
             return m.group(1)
     # IFCBOOLEAN
-    m = re.match(r"IFCBOOLEAN\(\.([TF])\.\)$", v)
+    m = REGEX_IFC_BOOLEANO.match(v)
     if m:
         return "Sim" if m.group(1) == "T" else "Não"
     # IFCINTEGER / IFCREAL
-    m = re.match(r"IFC(?:INTEGER|REAL|COUNTMEASURE)\((.+)\)$", v)
+    m = REGEX_IFC_NUMERO.match(v)
     if m:
         return m.group(1)
     # Valor nu (sem wrapper)
@@ -131,10 +142,12 @@ def limpar_valor(valor: str) -> str:
 # AUTENTICAÇÃO
 # ──────────────────────────────────────────────────────────────────────────────
 
+@st.cache_resource
 def conectar_sheets() -> gspread.Client:
     """
     Autentica usando st.secrets (produção) ou credenciais.json (local).
     Configure em .streamlit/secrets.toml — nunca versionar.
+    Cliente único por processo (st.cache_resource): sem reautenticar a cada rerun.
     """
     scopes = [
         "https://www.googleapis.com/auth/spreadsheets",
@@ -152,6 +165,12 @@ def conectar_sheets() -> gspread.Client:
     return gspread.authorize(creds)
 
 
+@st.cache_resource
+def abrir_planilha() -> gspread.Spreadsheet:
+    """Planilha aberta uma vez por processo: client.open faz uma busca no Drive a cada chamada."""
+    return conectar_sheets().open(NOME_PLANILHA)
+
+
 def verificar_senha() -> str:
     """
     Retorna a senha do secrets.toml.
@@ -174,44 +193,55 @@ def verificar_senha() -> str:
 # INDEXAÇÃO DE ARMADURAS (por sessão — sem estado global)
 # ──────────────────────────────────────────────────────────────────────────────
 
-def indexar_armaduras(ifc_file) -> dict:
+def _mapear_pavimentos(ifc) -> dict[int, str]:
+    """
+    Retorna {id_elemento: nome do IfcBuildingStorey} numa única passada sobre
+    IfcRelContainedInSpatialStructure, em vez de resolver a relação inversa
+    ContainedInStructure elemento a elemento.
+    Elementos fora do dict não estão contidos em pavimento ("Sem pavimento").
+    """
+    pavimentos: dict[int, str] = {}
+    for rel in ifc.by_type("IfcRelContainedInSpatialStructure"):
+        try:
+            nome = decode_ifc(rel.RelatingStructure.Name or "")
+            for elem in rel.RelatedElements:
+                pavimentos.setdefault(elem.id(), nome)
+        except Exception:
+            pass
+    return pavimentos
+
+
+def indexar_armaduras(ifc_file, pavimentos: dict[int, str] | None = None) -> dict:
     """
     Varre todas as IfcReinforcingBar do modelo e agrupa as bitolas
     por chave (nome_elemento, pavimento).
 
-    Retorna: { ('P1', 'Tipo-001'): [10.0, 10.0, 8.0, ...], ... }
+    Retorna: { ('P1', 'Tipo-001'): Counter({10.0: 2, 8.0: 1}), ... }
 
     O padrão de nome TQS é: "QTD NOME_ELEM ØDiam C=Comp (id N)"
     Exemplo: "3 P1 Ø10.00 C=265.00 (id 2)"
     """
     # Mapa elemento → pavimento (via IfcRelContainedInSpatialStructure)
-    storey_por_elem: dict[str, str] = {}
-    for rel in ifc_file.by_type("IfcRelContainedInSpatialStructure"):
-        try:
-            storey = rel.RelatingStructure.Name or "Sem pavimento"
-            for elem in rel.RelatedElements:
-                storey_por_elem[elem.id()] = decode_ifc(storey)
-        except Exception:
-            pass
+    if pavimentos is None:
+        pavimentos = _mapear_pavimentos(ifc_file)
 
-    cache: dict[tuple, list] = defaultdict(list)
+    cache: dict[tuple, Counter] = defaultdict(Counter)
 
-    for barra in ifc_file.by_type("IfcReinforcingBar"):
+    for barra in ifc_file.by_type("IfcReinforcingBar", include_subtypes=False):
         try:
             nome_raw = barra.Name or ""
             nome = decode_ifc(nome_raw)
-            # Remove sufixo de instância: "(id 2)", "(id 10)"
-            nome_base = re.sub(r'\s*\(id\s*\d+\)', '', nome).strip()
-
-            match = REGEX_BARRA.match(nome_base)
+            # REGEX_BARRA é ancorado no início e não exige fim de string: o
+            # sufixo de instância "(id 2)" não interfere, dispensando removê-lo
+            match = REGEX_BARRA.match(nome.strip())
             if not match:
                 continue
 
             nome_elem = match.group(1)          # "P1", "V3", "B1"...
             bitola    = float(match.group(2))   # 10.0, 8.0, 6.3...
 
-            pav = storey_por_elem.get(barra.id(), "Sem pavimento")
-            cache[(nome_elem, pav)].append(bitola)
+            pav = pavimentos.get(barra.id()) or "Sem pavimento"
+            cache[(nome_elem, pav)][bitola] += 1
 
         except Exception as e:
             st.warning(f"Barra ignorada (#{getattr(barra, 'id', '?')}): {e}")
@@ -228,8 +258,7 @@ def formatar_armadura(cache: dict, nome_elem: str, pavimento: str) -> str:
     chave = (nome_elem, pavimento)
     if chave not in cache:
         return "Verificar detalhamento"
-    contagem = Counter(cache[chave])
-    partes = sorted(contagem.items(), key=lambda x: -x[0])
+    partes = sorted(cache[chave].items(), reverse=True)
     return " + ".join(f"{qtd} ø{diam:.1f}" for diam, qtd in partes)
 
 
@@ -237,15 +266,46 @@ def formatar_armadura(cache: dict, nome_elem: str, pavimento: str) -> str:
 # EXTRAÇÃO DE DADOS POR TIPO DE ELEMENTO
 # ──────────────────────────────────────────────────────────────────────────────
 
-def _psets(elem) -> dict:
+def _mapear_psets(ifc) -> dict[int, list]:
+    """
+    Percorre IfcRelDefinesByType e IfcRelDefinesByProperties uma única vez e
+    retorna {id_elemento: [IfcPropertySetDefinition, ...]}, evitando que cada
+    elemento resolva sua relação inversa IsDefinedBy separadamente.
+    Como get_psets, inclui os Psets do tipo (HasPropertySets) — antes dos da
+    ocorrência, que prevalecem em _psets.
+    """
+    mapa: dict[int, list] = defaultdict(list)
+    for rel in ifc.by_type("IfcRelDefinesByType"):
+        defs = list(getattr(rel.RelatingType, "HasPropertySets", None) or [])
+        if defs:
+            for obj in rel.RelatedObjects or []:
+                mapa[obj.id()].extend(defs)
+    for rel in ifc.by_type("IfcRelDefinesByProperties"):
+        defs = rel.RelatingPropertyDefinition
+        defs = list(defs) if isinstance(defs, (list, tuple)) else [defs]
+        for obj in rel.RelatedObjects or []:
+            mapa[obj.id()].extend(defs)
+    return mapa
+
+
+def _psets(elem, defs: list | None = None) -> dict:
     """
     Retorna todos os Psets de um elemento como dict plano:
     { 'NomePset.NomeProp': 'valor_limpo' }
+    `defs`: definições já indexadas por _mapear_psets (senão usa get_psets).
     Nunca lança exceção — registra warning e continua.
     """
     resultado = {}
     try:
-        raw = ifcopenshell.util.element.get_psets(elem)
+        if defs is not None:
+            # Mesmo nome no tipo e na ocorrência: funde, a ocorrência prevalece
+            raw: dict[str, dict] = {}
+            for d in defs:
+                if getattr(d, "Name", None):
+                    raw.setdefault(d.Name, {}).update(
+                        ifcopenshell.util.element.get_property_definition(d) or {})
+        else:
+            raw = ifcopenshell.util.element.get_psets(elem)
         for pset_nome, props in raw.items():
             pset_dec = decode_ifc(str(pset_nome))
             for prop_nome, prop_val in props.items():
@@ -257,19 +317,18 @@ def _psets(elem) -> dict:
     return resultado
 
 
-def _pavimento(elem) -> str:
-    """Retorna nome do IfcBuildingStorey do elemento."""
-    try:
-        if elem.ContainedInStructure:
-            return decode_ifc(elem.ContainedInStructure[0].RelatingStructure.Name or "")
-    except Exception:
-        pass
-    return "Sem pavimento"
+# Varredura de _bbox: atributos que levam aos IfcCartesianPoint. Quais deles
+# cada classe IFC possui depende só do schema — resolvido uma vez por classe.
+_ATRIBUTOS_GEOMETRIA = ("Points", "OuterCurve", "PolygonalBoundary", "Polygon",
+                        "Items", "MappedRepresentation", "MappingSource",
+                        "SweptArea", "Bounds", "Bound", "CfsFaces", "FbsmFaces",
+                        "Position", "BaseSurface")
+_ATRIBUTOS_POR_CLASSE: dict[str, tuple[str, ...]] = {}
 
 
 def _bbox(elem) -> dict:
     """
-    Extrai bounding box 3D por varredura recursiva dos CartesianPoints.
+    Extrai bounding box 3D por varredura (pilha explícita) dos CartesianPoints.
     Unidade do TQS: centímetros (IFCSIUNIT CENTI METRE).
     Retorna dimensões em cm e coordenadas do centróide.
     Nunca lança exceção — retorna zeros com warning.
@@ -280,57 +339,64 @@ def _bbox(elem) -> dict:
         if not getattr(elem, "Representation", None):
             return vazio
 
-        xs, ys, zs = [], [], []
+        # Buffers contíguos de float64: x,y de todos os pontos; z apenas dos 3D
+        pts, zs = array.array("d"), array.array("d")
+        # Entidades já visitadas pelo id STEP (pontos compartilhados entre faces);
+        # id(obj) não serve: cada acesso cria um wrapper Python novo.
         visitados: set = set()
 
-        def coletar(obj, profundidade=0):
+        # Varredura iterativa com pilha explícita de (obj, profundidade)
+        pilha = [(item, 0)
+                 for rep in elem.Representation.Representations
+                 if rep.RepresentationIdentifier in ("Body", "Mesh", "Box", "Facetation", "Axis")
+                 for item in rep.Items]
+        while pilha:
+            obj, profundidade = pilha.pop()
             if obj is None or profundidade > 14:
-                return
-            oid = id(obj)
-            if oid in visitados:
-                return
-            visitados.add(oid)
-
-            if hasattr(obj, "is_a"):
-                if obj.is_a("IfcCartesianPoint") and hasattr(obj, "Coordinates"):
-                    c = obj.Coordinates
-                    if len(c) >= 2:
-                        xs.append(float(c[0]))
-                        ys.append(float(c[1]))
-                        if len(c) >= 3:
-                            zs.append(float(c[2]))
-                    return
-
-                for attr in ("Points", "OuterCurve", "PolygonalBoundary", "Polygon",
-                             "Items", "MappedRepresentation", "MappingSource",
-                             "SweptArea", "Bounds", "Bound", "CfsFaces", "FbsmFaces",
-                             "Position", "BaseSurface"):
-                    if not hasattr(obj, attr):
-                        continue
-                    val = getattr(obj, attr)
-                    if isinstance(val, (list, tuple)):
-                        for v in val:
-                            coletar(v, profundidade + 1)
-                    else:
-                        coletar(val, profundidade + 1)
-
-            elif isinstance(obj, (list, tuple)):
-                for item in obj:
-                    coletar(item, profundidade + 1)
-
-        for rep in elem.Representation.Representations:
-            if rep.RepresentationIdentifier in ("Body", "Mesh", "Box", "Facetation", "Axis"):
-                for item in rep.Items:
-                    coletar(item)
-
-        if not xs:
+                continue
+
+            if isinstance(obj, (list, tuple)):
+                pilha.extend((v, profundidade + 1) for v in obj)
+                continue
+            if not hasattr(obj, "is_a"):
+                continue
+            oid = obj.id()
+            if oid:
+                if oid in visitados:
+                    continue
+                visitados.add(oid)
+
+            classe = obj.is_a()
+            if classe == "IfcCartesianPoint":
+                c = obj.Coordinates
+                if len(c) >= 2:
+                    pts.extend(c[:2])
+                    if len(c) >= 3:
+                        zs.append(c[2])
+                continue
+
+            atributos = _ATRIBUTOS_POR_CLASSE.get(classe)
+            if atributos is None:
+                atributos = _ATRIBUTOS_POR_CLASSE[classe] = tuple(
+                    a for a in _ATRIBUTOS_GEOMETRIA if hasattr(obj, a))
+            for attr in atributos:
+                val = getattr(obj, attr)
+                if isinstance(val, (list, tuple)):
+                    pilha.extend((v, profundidade + 1) for v in val)
+                else:
+                    pilha.append((val, profundidade + 1))
+
+        if not pts:
             return vazio
 
-        comp = round(max(xs) - min(xs), 2)
-        larg = round(max(ys) - min(ys), 2)
-        alt  = round(max(zs) - min(zs), 2) if zs else 0.0
-        cx   = round((min(xs) + max(xs)) / 2, 2)
-        cy   = round((min(ys) + max(ys)) / 2, 2)
+        # Redução min/max vetorizada (NumPy) em vez de 4 passagens em listas
+        xy = np.frombuffer(pts, dtype=np.float64).reshape(-1, 2)
+        mn, mx = xy.min(axis=0), xy.max(axis=0)
+        comp = round(float(mx[0] - mn[0]), 2)
+        larg = round(float(mx[1] - mn[1]), 2)
+        alt  = round(float(np.ptp(np.frombuffer(zs, dtype=np.float64))), 2) if zs else 0.0
+        cx   = round(float(mn[0] + mx[0]) / 2, 2)
+        cy   = round(float(mn[1] + mx[1]) / 2, 2)
 
         return {"comp_cm": comp, "larg_cm": larg, "alt_cm": alt,
                 "coord_x": cx, "coord_y": cy}
@@ -343,9 +409,9 @@ def _bbox(elem) -> dict:
 def _id_unico(elem, id_projeto: str, pavimento: str) -> str:
     """Chave primária única e segura para uso como QR Code."""
     guid  = (elem.GlobalId or "NOGUID")[:8]
-    nome  = re.sub(r"[^A-Z0-9]", "", (elem.Name or "").upper())[:8]
-    pav   = re.sub(r"[^A-Z0-9]", "", pavimento.upper())[:8]
-    proj  = re.sub(r"[^A-Z0-9]", "", id_projeto.upper())[:10]
+    nome  = REGEX_NAO_CHAVE.sub("", (elem.Name or "").upper())[:8]
+    pav   = REGEX_NAO_CHAVE.sub("", pavimento.upper())[:8]
+    proj  = REGEX_NAO_CHAVE.sub("", id_projeto.upper())[:10]
     return f"{proj}-{pav}-{nome}-{guid}"
 
 
@@ -370,9 +436,13 @@ def _volume_m3(geo: dict, tipo_ifc: str) -> float:
 # PIPELINE PRINCIPAL DE EXTRAÇÃO
 # ──────────────────────────────────────────────────────────────────────────────
 
-def _natural_key(texto: str) -> list:
-    return [int(c) if c.isdigit() else c.lower()
-            for c in re.split(r"(\d+)", texto or "")]
+REGEX_DIGITOS = re.compile(r"(\d+)")
+
+
+def _natural_key(texto: str) -> tuple:
+    """Chave de ordenação natural (P2 < P10); tupla compara sem alocar listas."""
+    return tuple(int(c) if c.isdigit() else c.lower()
+                 for c in REGEX_DIGITOS.split(texto or ""))
 
 
 def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict]:
@@ -381,11 +451,13 @@ def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict
     Retorna lista de dicts prontos para o Sheets / PDF.
     """
     ifc = ifcopenshell.open(caminho)
+    pavimentos = _mapear_pavimentos(ifc)   # um mapa para barras e elementos
+    psets_por_elem = _mapear_psets(ifc)
 
     # ── 1. Indexar armaduras (uma única passagem sobre as 6943 barras) ────────
     with st.spinner("Indexando armaduras (IfcReinforcingBar)..."):
-        cache_arm = indexar_armaduras(ifc)
-    st.info(f"Armaduras indexadas: {sum(len(v) for v in cache_arm.values())} barras "
+        cache_arm = indexar_armaduras(ifc, pavimentos)
+    st.info(f"Armaduras indexadas: {sum(sum(v.values()) for v in cache_arm.values())} barras "
             f"em {len(cache_arm)} combinações (elemento, pavimento)")
 
     # ── 2. Processar cada tipo estrutural ─────────────────────────────────────
@@ -396,8 +468,13 @@ def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict
         st.warning("Nenhum elemento estrutural encontrado. Verifique se o IFC é do TQS.")
         return []
 
+    # Texto da armadura por (nome, pavimento): elementos homônimos no mesmo
+    # pavimento (segmentos de viga, sapatas duplicadas) formatam uma vez só
+    armaduras_fmt: dict[tuple, str] = {}
+
     progresso = st.progress(0.0, text="Extraindo elementos...")
     processados = 0
+    passo = max(1, total // 100)   # ≤ 100 atualizações da barra por execução
 
     for tipo_ifc, tipo_legivel in TIPOS_ESTRUTURAIS.items():
         elementos = ifc.by_type(tipo_ifc)
@@ -406,15 +483,16 @@ def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict
 
         for elem in elementos:
             processados += 1
-            progresso.progress(
-                processados / total,
-                text=f"{tipo_legivel}: {elem.Name or '?'} ({processados}/{total})"
-            )
+            if processados % passo == 0 or processados == total:
+                progresso.progress(
+                    processados / total,
+                    text=f"{tipo_legivel}: {elem.Name or '?'} ({processados}/{total})"
+                )
 
             nome     = elem.Name or "S/N"
-            pavimento = _pavimento(elem)
+            pavimento = pavimentos.get(elem.id(), "Sem pavimento")
             geo      = _bbox(elem)
-            ps       = _psets(elem)
+            ps       = _psets(elem, psets_por_elem.get(elem.id(), []))
             volume   = _volume_m3(geo, tipo_ifc)
 
             # ── Extrair campos específicos dos Psets TQS ──────────────────────
@@ -469,7 +547,10 @@ def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict
                 descricao_geo = (f"{geo['comp_cm']:.0f}×{geo['larg_cm']:.0f}×"
                                  f"{geo['alt_cm']:.0f} cm")
 
-            armadura = formatar_armadura(cache_arm, nome, pavimento)
+            armadura = armaduras_fmt.get((nome, pavimento))
+            if armadura is None:
+                armadura = armaduras_fmt[(nome, pavimento)] = formatar_armadura(
+                    cache_arm, nome, pavimento)
 
             registro = {
                 "ID_Unico":         _id_unico(elem, id_projeto, pavimento),
@@ -500,6 +581,7 @@ def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict
     progresso.progress(1.0, text="Extração concluída.")
 
     # Ordenação: pavimento → tipo → nome natural
+    # list.sort calcula a chave uma vez por registro (decorate-sort-undecorate)
     registros.sort(key=lambda r: (
         r["Pavimento"],
         r["Tipo_Legivel"],
@@ -508,6 +590,37 @@ def processar_ifc(caminho: str, nome_projeto: str, id_projeto: str) -> list[dict
     return registros
 
 
+TAMANHO_BLOCO = 1 << 20   # 1 MiB por leitura do upload
+
+
+def hash_upload(arquivo) -> str:
+    """blake2b do upload lido em blocos (chave de processar_ifc_em_cache)."""
+    h = hashlib.blake2b()
+    arquivo.seek(0)
+    for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO), b""):
+        h.update(bloco)
+    arquivo.seek(0)
+    return h.hexdigest()
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def processar_ifc_em_cache(_arquivo, hash_arquivo: str,
+                           nome_projeto: str, id_projeto: str) -> list[dict]:
+    """
+    Processa o IFC do upload, reaproveitando o resultado quando o mesmo arquivo
+    (mesmo hash) é reenviado para a mesma obra. O upload é copiado em blocos
+    para um temp seguro (sempre removido no finally), sem getvalue().
+    """
+    _arquivo.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".ifc") as tmp:
+        shutil.copyfileobj(_arquivo, tmp, TAMANHO_BLOCO)
+        caminho_tmp = tmp.name
+    try:
+        return processar_ifc(caminho_tmp, nome_projeto, id_projeto)
+    finally:
+        os.unlink(caminho_tmp)
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # GERAÇÃO DE PDF (100% em memória — sem arquivos temporários)
 # ──────────────────────────────────────────────────────────────────────────────
@@ -527,6 +640,17 @@ def gerar_pdf(registros: list[dict], nome_projeto: str) -> io.BytesIO:
     COLS = 2
 
     c.setTitle(f"Etiquetas BIM — {nome_projeto}")
+    # Um único QRCode, com versão (tamanho) e máscara do ID mais longo: os IDs
+    # têm o mesmo formato, então cada etiqueta pula o ajuste de versão e a
+    # avaliação das 8 máscaras
+    qr = qrcode.QRCode(box_size=8, border=1,
+                       error_correction=qrcode.constants.ERROR_CORRECT_M)
+    if registros:
+        qr.add_data(max((r["ID_Unico"] for r in registros), key=len))
+        # best_fit só fixa a versão; make(fit=True) já avaliaria as 8 máscaras
+        # e best_mask_pattern() as avaliaria de novo
+        qr.best_fit()
+        qr.mask_pattern = qr.best_mask_pattern()
     col, x, y = 0, MH, H_PAG - MV - ALTA
 
     COR_FUNDO  = {
@@ -552,15 +676,15 @@ def gerar_pdf(registros: list[dict], nome_projeto: str) -> io.BytesIO:
         c.rect(x, y, LARG, ALTA, fill=0, stroke=1)
 
         # ── QR Code em memória ────────────────────────────────────────────────
-        qr = qrcode.QRCode(box_size=8, border=1,
-                           error_correction=qrcode.constants.ERROR_CORRECT_M)
+        qr.clear()
         qr.add_data(reg["ID_Unico"])
-        qr.make(fit=True)
+        try:
+            qr.make(fit=False)
+        except qrcode.exceptions.DataOverflowError:
+            qr.make(fit=True)
         img_pil = qr.make_image(fill_color="black", back_color="white")
-        buf_qr = io.BytesIO()
-        img_pil.save(buf_qr, format="PNG")
-        buf_qr.seek(0)
-        c.drawImage(ImageReader(buf_qr),
+        # Imagem PIL direto ao ImageReader: sem codificar/decodificar PNG
+        c.drawImage(ImageReader(img_pil.convert("L")),
                     x + 2*mm, y + 5*mm, width=38*mm, height=38*mm)
 
         # ── Textos ────────────────────────────────────────────────────────────
@@ -616,25 +740,14 @@ def gerar_pdf(registros: list[dict], nome_projeto: str) -> io.BytesIO:
 # PERSISTÊNCIA NO GOOGLE SHEETS
 # ──────────────────────────────────────────────────────────────────────────────
 
-def salvar_no_sheets(client: gspread.Client, id_proj: str,
+def salvar_no_sheets(sh: gspread.Spreadsheet, id_proj: str,
                      nome: str, registros: list[dict]) -> None:
     """
-    Salva projeto e elementos no Google Sheets de forma segura.
-    Estratégia: monta DataFrame completo em memória ANTES de fazer clear().
-    Isso garante que, se houver erro de rede, nenhum dado existente é perdido.
+    Salva projeto e elementos no Google Sheets.
+    Estratégia: troca só as linhas do projeto em Projetos e Elementos
+    (planilhas.sincronizar_abas) — as linhas de outros projetos nunca são
+    reescritas.
     """
-    sh = client.open(NOME_PLANILHA)
-
-    # ── Aba Projetos ──────────────────────────────────────────────────────────
-    try:
-        ws_p = sh.worksheet("Projetos")
-    except gspread.WorksheetNotFound:
-        ws_p = sh.add_worksheet("Projetos", 200, 8)
-
-    df_p = pd.DataFrame(ws_p.get_all_records())
-    if not df_p.empty and "ID_Projeto" in df_p.columns:
-        df_p = df_p[df_p["ID_Projeto"] != id_proj]
-
     tipos_count = Counter(r["Tipo_Legivel"] for r in registros)
     vol_total = round(sum(r.get("Volume_m3", 0) for r in registros), 3)
 
@@ -646,35 +759,11 @@ def salvar_no_sheets(client: gspread.Client, id_proj: str,
         "Volume_Total_m3":     vol_total,
         "Resumo_Tipos":        " | ".join(f"{t}: {n}" for t, n in tipos_count.items()),
     }
-    df_p = pd.concat([df_p, pd.DataFrame([novo])], ignore_index=True).fillna("").astype(str)
-    ws_p.clear()
-    ws_p.update([df_p.columns.tolist()] + df_p.values.tolist())
-
-    # ── Aba Elementos ─────────────────────────────────────────────────────────
-    try:
-        ws_e = sh.worksheet("Elementos")
-    except gspread.WorksheetNotFound:
-        ws_e = sh.add_worksheet("Elementos", 5000, 25)
 
-    df_e = pd.DataFrame(ws_e.get_all_records())
-    if not df_e.empty and "Projeto_Ref" in df_e.columns:
-        df_e = df_e[df_e["Projeto_Ref"] != id_proj]
-
-    df_novos = pd.DataFrame(registros).fillna("").astype(str)
-
-    # União de colunas (novos podem ter colunas a mais)
-    todas_cols = list(dict.fromkeys(
-        (df_e.columns.tolist() if not df_e.empty else []) +
-        df_novos.columns.tolist()
-    ))
-    if not df_e.empty:
-        df_e = df_e.reindex(columns=todas_cols, fill_value="")
-    df_novos = df_novos.reindex(columns=todas_cols, fill_value="")
-
-    # Monta tudo em memória → só então faz clear()
-    df_final = pd.concat([df_e, df_novos], ignore_index=True).fillna("").astype(str)
-    ws_e.clear()
-    ws_e.update([df_final.columns.tolist()] + df_final.values.tolist())
+    ws_p = obter_aba(sh, "Projetos", [novo])
+    ws_e = obter_aba(sh, "Elementos", registros)
+    sincronizar_abas(sh, id_proj, [(ws_p, "ID_Projeto", [novo]),
+                                   (ws_e, "Projeto_Ref", registros)])
 
 
 # ──────────────────────────────────────────────────────────────────────────────
@@ -702,7 +791,7 @@ def _tela_principal() -> None:
     with st.sidebar:
         st.header("Obra")
         nome = st.text_input("Nome da obra", placeholder="Ex: Edifício Residencial Aurora")
-        id_proj = re.sub(r"[^A-Z0-9]", "", nome.upper())[:12] if nome else ""
+        id_proj = REGEX_NAO_CHAVE.sub("", nome.upper())[:12] if nome else ""
         if id_proj:
             st.caption(f"ID interno: `{id_proj}`")
         st.divider()
@@ -730,15 +819,7 @@ def _tela_principal() -> None:
         return
 
     if st.button("🚀 Processar IFC", type="primary"):
-        # Salva arquivo em temp seguro (sempre removido no finally)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".ifc") as tmp:
-            tmp.write(arquivo.getvalue())
-            caminho_tmp = tmp.name
-
-        try:
-            registros = processar_ifc(caminho_tmp, nome, id_proj)
-        finally:
-            os.unlink(caminho_tmp)
+        registros = processar_ifc_em_cache(arquivo, hash_upload(arquivo), nome, id_proj)
 
         if not registros:
             return
@@ -776,9 +857,10 @@ def _tela_principal() -> None:
     st.divider()
     colunas_view = ["Nome", "Tipo_Legivel", "Pavimento", "Geometria",
                     "Armadura", "Material", "Cobrimento_cm", "Volume_m3", "Status"]
-    df_view = pd.DataFrame(filtrados)[
-        [c for c in colunas_view if c in pd.DataFrame(filtrados).columns]
-    ]
+    # Só as colunas exibidas, montadas direto dos dicts (um único DataFrame)
+    cols_view = [c for c in colunas_view if filtrados and c in filtrados[0]]
+    df_view = pd.DataFrame([[r.get(c, "") for c in cols_view] for r in filtrados],
+                           columns=cols_view)
     st.dataframe(df_view, use_container_width=True, height=340)
     st.caption(f"Exibindo {len(filtrados)} de {len(registros)} elementos")
 
@@ -789,9 +871,9 @@ def _tela_principal() -> None:
     if col_a.button("☁️ Sincronizar com Google Sheets"):
         try:
             with st.spinner("Conectando..."):
-                client = conectar_sheets()
+                sh = abrir_planilha()
             with st.spinner(f"Salvando {len(registros)} elementos..."):
-                salvar_no_sheets(client, id_proj, nome, registros)
+                salvar_no_sheets(sh, id_proj, nome, registros)
             st.success(f"✅ {len(registros)} elementos sincronizados com sucesso!")
         except Exception as e:
             st.error(f"Erro na sincronização: {e}")
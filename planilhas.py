@@ -0,0 +1,107 @@
+"""
+Sincronização com o Google Sheets, compartilhada por app.py, app_vcauldef.py
+e app_00.py.
+
+Cada envio troca só as linhas do projeto em cada aba: uma leitura em lote
+(values_batch_get), um batch_update com as deleções e a expansão da grade e
+uma única gravação RAW (values_batch_update) — as linhas de outros projetos
+nunca são reescritas.
+"""
+
+import gspread
+
+
+def obter_aba(sh: gspread.Spreadsheet, titulo: str,
+              registros: list[dict]) -> gspread.Worksheet:
+    """Aba pelo título; se não existir, é criada já do tamanho do cabeçalho + registros."""
+    try:
+        return sh.worksheet(titulo)
+    except gspread.WorksheetNotFound:
+        colunas = len(dict.fromkeys(c for r in registros for c in r))
+        return sh.add_worksheet(titulo, len(registros) + 1, max(colunas, 1))
+
+
+def ler_abas(sh: gspread.Spreadsheet,
+             abas: list[tuple]) -> list[tuple[list, list, int]]:
+    """
+    Lê o conteúdo das abas por colunas numa única chamada values_batch_get.
+    abas: [(ws, coluna_chave)] → [(cabecalho, chaves, usadas)] na mesma ordem.
+    usadas é a coluna mais longa (cabeçalho incluído), não a coluna-chave:
+    linhas com a chave vazia também estão ocupadas.
+    """
+    resp = sh.values_batch_get([f"'{ws.title}'" for ws, _ in abas],
+                               params={"majorDimension": "COLUMNS"})
+    leituras = []
+    for (ws, chave), vr in zip(abas, resp.get("valueRanges", [])):
+        colunas = vr.get("values") or []
+        cab = [col[0] if col else "" for col in colunas]
+        chaves = colunas[cab.index(chave)] if chave in cab else []
+        leituras.append((cab, chaves, max(map(len, colunas), default=0)))
+    return leituras
+
+
+def substituir_linhas_projeto(ws: gspread.Worksheet, chave: str, id_proj: str,
+                              registros: list[dict], cabecalho: list,
+                              chaves: list, usadas: int,
+                              requisicoes: list[dict]) -> list[dict]:
+    """
+    Acrescenta em requisicoes os deleteDimension das linhas do projeto (blocos
+    contíguos, de baixo para cima) e o appendDimension que a grade precisar,
+    e devolve os intervalos a gravar: cabeçalho (com colunas novas) + linhas
+    do projeto depois da última linha usada. Se o projeto ocupa um único bloco
+    com o mesmo número de linhas (a linha em Projetos, ou o mesmo IFC
+    reenviado), sobrescreve no lugar, sem apagar nada.
+    """
+    chave_existia = chave in cabecalho
+    cabecalho = list(cabecalho)
+    cabecalho += dict.fromkeys(c for r in registros for c in r if c not in cabecalho)
+    if chave not in cabecalho:
+        return []
+
+    linhas_proj = [n for n, v in enumerate(chaves[1:], start=2) if v == id_proj]
+
+    blocos: list[list[int]] = []
+    for n in linhas_proj:
+        if blocos and blocos[-1][1] == n - 1: blocos[-1][1] = n
+        else: blocos.append([n, n])
+    if chave_existia and len(blocos) == 1 and len(linhas_proj) == len(registros):
+        apagadas = 0
+        primeira_livre = blocos[0][0]
+    else:
+        for ini, fim in reversed(blocos):
+            requisicoes.append({"deleteDimension": {"range": {
+                "sheetId": ws.id, "dimension": "ROWS", "startIndex": ini - 1, "endIndex": fim}}})
+        apagadas = len(linhas_proj)
+        primeira_livre = max(usadas, 1) - apagadas + 1
+    linhas = [["" if r.get(c) is None else str(r[c]) for c in cabecalho] for r in registros]
+
+    # values_batch_update não expande a grade (erro "exceeds grid limits"):
+    # garante linhas/colunas suficientes no mesmo batch_update das deleções
+    faltam_l = primeira_livre + len(linhas) - 1 - (ws.row_count - apagadas)
+    faltam_c = len(cabecalho) - ws.col_count
+    for dim, falta in (("ROWS", faltam_l), ("COLUMNS", faltam_c)):
+        if falta > 0:
+            requisicoes.append({"appendDimension": {
+                "sheetId": ws.id, "dimension": dim, "length": falta}})
+
+    return [
+        {"range": f"'{ws.title}'!A1",               "values": [cabecalho]},
+        {"range": f"'{ws.title}'!A{primeira_livre}", "values": linhas},
+    ]
+
+
+def sincronizar_abas(sh: gspread.Spreadsheet, id_proj: str,
+                     abas: list[tuple]) -> None:
+    """
+    Substitui as linhas do projeto em cada aba.
+    abas: [(ws, coluna_chave, registros)].
+    """
+    leituras = ler_abas(sh, [(ws, chave) for ws, chave, _ in abas])
+    intervalos, requisicoes = [], []
+    for (ws, chave, regs), (cab, chaves, usadas) in zip(abas, leituras):
+        intervalos += substituir_linhas_projeto(ws, chave, id_proj, regs, cab,
+                                                chaves, usadas, requisicoes)
+    if requisicoes:
+        sh.batch_update({"requests": requisicoes})
+    if intervalos:
+        sh.values_batch_update({"valueInputOption": "RAW", "data": intervalos})